@@ -0,0 +1,154 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+from common_imports import *
+
+log = get_logger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def measure(func, setup=None, repeat=5, min_time=.2, max_number=100000):
+    """
+    Time a callable the way timeit does: the number of calls per run
+    is grown until a run takes at least min_time, then repeat runs are
+    made and the per-call times kept.  With setup given, every call is
+    timed on its own on a fresh setup() value, e.g. a population that
+    the benchmarked call consumes.
+
+    :param func: Callable to time; takes setup()'s value if setup
+    is given
+    :param setup: Optional untimed callable run before every call
+    :param repeat: Number of timed runs
+    :param min_time: Shortest run, in seconds, when calls are batched
+    :param max_number: Most calls per run
+    :return: Dict with number, repeat, best, median and mean seconds
+    per call
+    """
+    if setup is not None:
+        times = []
+        for _ in range(repeat):
+            state = setup()
+            start = time.perf_counter()
+            func(state)
+            times.append(time.perf_counter() - start)
+        number = 1
+    else:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time or number >= max_number:
+                break
+            number = min(max_number, number * 10 if elapsed < min_time
+                         / 10 else int(number * min_time / elapsed) + 1)
+        times = [elapsed / number]
+        for _ in range(repeat - 1):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            times.append((time.perf_counter() - start) / number)
+    return {"number": number,
+            "repeat": repeat,
+            "best": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    """
+    Metadata needed to judge whether two result files are comparable.
+    """
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": _git_commit(),
+    }
+
+
+def result_key(result):
+    params = ",".join(f"{key}={value}" for key, value
+                      in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+def save_results(path, results, env=None):
+    with open(path, "w") as f:
+        json.dump({"environment": env or environment(),
+                   "results": results}, f, indent=2)
+    return None
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=.2):
+    """
+    Compare results with a baseline run, matching cases by name and
+    parameters.  A case regressed when its best time grew by more
+    than threshold (a fraction), and improved when it shrank by as
+    much.
+    :param results: List of result dicts
+    :param baseline: List of result dicts from an earlier run
+    :param threshold: Relative change that counts
+    :return: List of (key, baseline best, best, ratio, status), status
+    being "regression", "improvement" or "ok"
+    """
+    previous = {result_key(result): result for result in baseline}
+    ans = []
+    for result in results:
+        key = result_key(result)
+        if key not in previous:
+            continue
+        before = previous[key]["best"]
+        ratio = result["best"] / before if before else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        ans.append((key, before, result["best"], ratio, status))
+    return ans
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def main():
+    print(json.dumps(environment(), indent=2))
+    print(format_time(measure(lambda: sum(range(1000)))["best"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+from benchmarks.harness import ROOT, measure, format_time
+from common_imports import *
+
+log = get_logger(__name__)
+
+# The headless engine must import with NumPy alone
+CORE_MODULES = (
+    "src.utils.helpers",
+    "src.objects.chromosome",
+    "src.objects.individual",
+    "src.objects.experiment",
+)
+LAZY_MODULES = ("matplotlib", "tkinter", "tqdm", "colorlog", "PIL")
+
+_PROBE = """
+import json, sys
+import {module}
+print(json.dumps(sorted(name for name in {lazy}
+                        if name in sys.modules)))
+"""
+
+
+def run_python(code):
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+
+
+def import_time(module, repeat=5):
+    """
+    Time importing module in a fresh interpreter, less the cost of
+    starting the interpreter itself.
+    :return: measure() result dict for the import alone
+    """
+    timing = measure(lambda: run_python(f"import {module}"),
+                     repeat=repeat, min_time=0)
+    startup = measure(lambda: run_python("pass"), repeat=repeat,
+                      min_time=0)
+    return {key: max(value - startup[key], 0.)
+            if key in ("best", "median", "mean") else value
+            for key, value in timing.items()}
+
+
+def eager_imports(module):
+    """
+    Which of LAZY_MODULES importing module loads.
+    """
+    out = run_python(_PROBE.format(module=module, lazy=LAZY_MODULES))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    failures = 0
+    for module in CORE_MODULES:
+        loaded = eager_imports(module)
+        timing = import_time(module)
+        print(f"{module:<28} {format_time(timing['best']):>10}  "
+              f"{'loads ' + ', '.join(loaded) if loaded else 'ok'}")
+        failures += bool(loaded)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
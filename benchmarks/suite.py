@@ -0,0 +1,357 @@
+import argparse
+import itertools
+import os
+import sys
+
+# Progress bars would swamp the report; tqdm reads this at import
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import numpy as np
+from src.utils import helpers as h
+from src.objects.chromosome import Chromosome, Codon
+from src.objects.individual import Individual, Fittest
+from src.objects.packed import PackedPopulation
+from src.objects.diploid import DiploidPopulation, MaskDominance, \
+    get_dominance, get_meiosis
+from src.objects.experiment import SimpleExperiment
+from src.objects.fitness import number_ones
+from src.objects.selection import get_selection
+from benchmarks.imports import CORE_MODULES, run_python
+from benchmarks.harness import measure, environment, save_results, \
+    load_results, compare, result_key, format_time
+from common_imports import *
+
+log = get_logger(__name__)
+
+PROFILES = ("quick", "full")
+
+# name -> (factory, {profile: [params, ...]})
+BENCHMARKS = {}
+
+
+def grid(**axes):
+    """
+    Every combination of the given parameter values, as dicts.
+    """
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*axes.values())]
+
+
+def benchmark(name, quick, full=None):
+    """
+    Register a benchmark.  The decorated factory takes one parameter
+    dict and returns (func, setup) for measure().
+    :param name: Benchmark name, dotted by component
+    :param quick: Parameter dicts for the quick profile
+    :param full: Parameter dicts for the full profile, defaults to
+    quick
+    """
+    def wrap(factory):
+        BENCHMARKS[name] = (factory, {"quick": quick,
+                                      "full": full or quick})
+        return factory
+    return wrap
+
+
+def _codon(length):
+    return Codon(int(np.random.randint(0, 2 ** min(length, 62))),
+                 length=length)
+
+
+def _individual(num_codons, length):
+    return Individual([Chromosome([_codon(length)
+                                   for _ in range(num_codons)])])
+
+
+def _population(size, num_codons=1, length=8):
+    genes = np.random.randint(0, 2, (size, num_codons * length),
+                              dtype=np.uint8)
+    return PackedPopulation(genes, codon_length=length,
+                            num_codons=num_codons)
+
+
+def _diploid(size, num_codons=1, length=8, dominance="complete"):
+    genes = np.random.randint(0, 2, (size, 2 * num_codons * length),
+                              dtype=np.uint8)
+    if dominance == "mask":
+        dominance = MaskDominance(np.random.randint(
+            0, 2, num_codons * length))
+    return DiploidPopulation(genes, codon_length=length,
+                             num_codons=num_codons,
+                             dominance=get_dominance(dominance))
+
+
+@benchmark("encoder.encode_num", grid(length=[8, 64]))
+def bench_encode_num(params):
+    encoder = h.get_encoder(max_len=params["length"])
+    num = encoder.max_num // 3
+    return (lambda: encoder.encode_num_to_bitstring(num)), None
+
+
+@benchmark("encoder.decode_bitstring", grid(length=[8, 64]))
+def bench_decode_bitstring(params):
+    encoder = h.get_encoder(max_len=params["length"])
+    bitstring = encoder.encode_num_to_bitstring(encoder.max_num // 3)
+    return (lambda: encoder.decode_bitstring_to_num(bitstring)), None
+
+
+@benchmark("encoder.encode_many",
+           grid(size=[10 ** 2, 10 ** 4], length=[8, 32]),
+           grid(size=[10 ** k for k in range(2, 7)], length=[8, 32]))
+def bench_encode_many(params):
+    encoder = h.get_encoder(max_len=params["length"])
+    nums = np.random.randint(0, encoder.max_num, params["size"],
+                             dtype=np.int64)
+    return (lambda: encoder.encode_many(nums)), None
+
+
+@benchmark("encoder.decode_many",
+           grid(size=[10 ** 2, 10 ** 4], length=[8, 32]),
+           grid(size=[10 ** k for k in range(2, 7)], length=[8, 32]))
+def bench_decode_many(params):
+    encoder = h.get_encoder(max_len=params["length"])
+    genes = np.random.randint(0, 2, (params["size"], params["length"]),
+                              dtype=np.uint8)
+    return (lambda: encoder.decode_many(genes)), None
+
+
+@benchmark("codon.fuse", grid(length=[8, 64, 256]))
+def bench_codon_fuse(params):
+    mother, father = _codon(params["length"]), _codon(params["length"])
+    crosspoint = params["length"] // 2
+    return (lambda: mother.fuse(father, crosspoint)), None
+
+
+@benchmark("codon.mutate", grid(length=[8, 64, 256]))
+def bench_codon_mutate(params):
+    codon = _codon(params["length"])
+    position = params["length"] // 2
+    return (lambda: codon.mutate(position)), None
+
+
+@benchmark("chromosome.fuse", grid(num_codons=[1, 4, 16], length=[8, 64]))
+def bench_chromosome_fuse(params):
+    num_codons, length = params["num_codons"], params["length"]
+    mother = Chromosome([_codon(length) for _ in range(num_codons)])
+    father = Chromosome([_codon(length) for _ in range(num_codons)])
+    crossovers = [length // 2] * num_codons
+    return (lambda: mother.fuse(father, crossovers)), None
+
+
+@benchmark("individual.random_mutation",
+           grid(num_codons=[1, 4], length=[8, 64], p_mutate=[.01]))
+def bench_random_mutation(params):
+    person = _individual(params["num_codons"], params["length"])
+    return (lambda: person.random_mutation(params["p_mutate"])), None
+
+
+@benchmark("population.sample_population",
+           grid(size=[10 ** 2, 10 ** 3, 10 ** 4],
+                method=["roulette", "tournament"]),
+           grid(size=[10 ** k for k in range(2, 7)],
+                method=["roulette", "tournament"]))
+def bench_sample_population(params):
+    pop = _population(params["size"]).to_population()
+    pop.apply_fitness(number_ones)
+    method = params["method"]
+    return (lambda: pop.sample_population(2, method)), None
+
+
+@benchmark("selection.update",
+           grid(size=[10 ** 3, 10 ** 5], num=[2],
+                method=["roulette", "rank", "tournament"]),
+           grid(size=[10 ** k for k in range(3, 7)], num=[2, 100],
+                method=["roulette", "rank", "tournament"]))
+def bench_selection_update(params):
+    size, num = params["size"], params["num"]
+    selection = get_selection(params["method"])
+    selection.prepare(np.random.random(size))
+    spacing = size // num
+
+    # Patch a few individuals, then draw parents for them
+    def update():
+        # Distinct indices without an O(size) permutation
+        indices = np.arange(num) * spacing \
+            + np.random.randint(0, spacing)
+        selection.update(indices, np.random.random(num))
+        selection.draw(2 * num)
+    return update, None
+
+
+@benchmark("fittest.add",
+           grid(size=[10 ** 2, 10 ** 4], num=[10]),
+           grid(size=[10 ** k for k in range(2, 6)], num=[10, 1000]))
+def bench_fittest_add(params):
+    people = _population(params["size"], length=64).to_population()
+    people.apply_fitness(number_ones)
+    people = people.individuals
+
+    def add_all(hall_of_fame):
+        for person in people:
+            hall_of_fame.add(person)
+
+    return add_all, lambda: Fittest(params["num"])
+
+
+@benchmark("experiment.run",
+           grid(size=[10 ** 2, 10 ** 3, 10 ** 4], num_codons=[1],
+                length=[64], kind=["packed", "object", "diploid"]),
+           grid(size=[10 ** k for k in range(2, 7)], num_codons=[1],
+                length=[64], kind=["packed"])
+           + grid(size=[10 ** k for k in range(2, 6)], num_codons=[1],
+                  length=[64], kind=["object"])
+           + grid(size=[10 ** k for k in range(2, 7)], num_codons=[1],
+                  length=[64], kind=["diploid"])
+           + grid(size=[10 ** 4], num_codons=[1, 4], length=[8, 256],
+                  kind=["packed"]))
+def bench_experiment_run(params):
+    generations = 5
+
+    def setup():
+        pop = _population(params["size"], params["num_codons"],
+                          params["length"])
+        if params["kind"] == "object":
+            pop = pop.to_population()
+        elif params["kind"] == "diploid":
+            pop = _diploid(params["size"], params["num_codons"],
+                           params["length"])
+        return SimpleExperiment(population=pop,
+                                generations=generations,
+                                p_cross=.9,
+                                p_mutate=.001,
+                                fitness_func=number_ones)
+
+    return (lambda experiment: experiment.run()), setup
+
+
+@benchmark("experiment.steady_state",
+           grid(size=[10 ** 3, 10 ** 5], num_offspring=[2],
+                selection=["roulette", "tournament"]),
+           grid(size=[10 ** k for k in range(3, 7)],
+                num_offspring=[2, 100],
+                selection=["roulette", "tournament"]))
+def bench_steady_state(params):
+    generations = 200
+
+    def setup():
+        return SimpleExperiment(
+            population=_population(params["size"], length=64),
+            generations=generations,
+            p_cross=.9,
+            p_mutate=.001,
+            fitness_func=number_ones,
+            selection=params["selection"],
+            replacement="steady_state",
+            replacement_options={"num_offspring":
+                                 params["num_offspring"]})
+
+    return (lambda experiment: experiment.run()), setup
+
+
+@benchmark("diploid.express",
+           grid(size=[10 ** 2, 10 ** 4],
+                dominance=["complete", "codominant", "mask"]),
+           grid(size=[10 ** k for k in range(2, 7)],
+                dominance=["complete", "codominant", "mask"]))
+def bench_diploid_express(params):
+    pop = _diploid(params["size"], length=64,
+                   dominance=params["dominance"])
+    out = np.empty((params["size"], 64), dtype=np.uint8)
+    return (lambda: pop.phenotype(out=out)), None
+
+
+@benchmark("diploid.meiosis",
+           grid(size=[10 ** 2, 10 ** 4], num_codons=[1, 4],
+                recombination=["single", "k_point"]),
+           grid(size=[10 ** k for k in range(2, 7)], num_codons=[1, 4],
+                recombination=["single", "k_point"]))
+def bench_diploid_meiosis(params):
+    pop = _diploid(params["size"], params["num_codons"], 16)
+    meiosis = get_meiosis(params["recombination"], .9)
+    half = params["size"] // 2
+    mothers, fathers = pop.genes[:half], pop.genes[half:2 * half]
+    return (lambda: meiosis(mothers, fathers, pop.layout)), None
+
+
+@benchmark("startup.import", grid(module=list(CORE_MODULES)))
+def bench_import(params):
+    # Fresh interpreter per call, so includes interpreter start up
+    code = f"import {params['module']}"
+    return (lambda: run_python(code)), None
+
+
+def run(profile="quick", pattern=None, repeat=5, min_time=.2,
+        report=print):
+    """
+    Run the registered benchmarks.
+    :param profile: One of PROFILES
+    :param pattern: Only run benchmarks whose name contains this
+    :param repeat: Timed runs per case
+    :param min_time: Shortest batched run, in seconds
+    :param report: Called with a line of text per finished case
+    :return: List of result dicts
+    """
+    results = []
+    for name, (factory, profiles) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        for params in profiles[profile]:
+            func, setup = factory(params)
+            # Object benchmarks with setup are slow; fewer runs do
+            timing = measure(func, setup,
+                             repeat=repeat if setup is None
+                             else max(1, repeat // 2 + 1),
+                             min_time=min_time)
+            result = {"name": name, "params": params, **timing}
+            results.append(result)
+            if report is not None:
+                report(f"{result_key(result):<70} "
+                       f"{format_time(result['best']):>10}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the genetic algorithm building blocks.")
+    parser.add_argument("--profile", choices=PROFILES, default="quick",
+                        help="full goes up to 10^6 individuals")
+    parser.add_argument("--filter", dest="pattern",
+                        help="only run benchmarks whose name contains "
+                             "this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=.2)
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--baseline",
+                        help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=.2,
+                        help="relative slow down that counts as a "
+                             "regression")
+    args = parser.parse_args(argv)
+
+    env = environment()
+    print(f"Python {env['python']}, NumPy {env['numpy']}, "
+          f"{env['cpu_count']} CPUs, commit {env['git_commit']}")
+    results = run(args.profile, args.pattern, args.repeat, args.min_time)
+    if args.output:
+        save_results(args.output, results, env)
+    if not args.baseline:
+        return 0
+    baseline = load_results(args.baseline)
+    if baseline["environment"].get("platform") != env["platform"]:
+        log.warning("Baseline was recorded on a different platform")
+    regressions = 0
+    for key, before, after, ratio, status in compare(
+            results, baseline["results"], args.threshold):
+        if status != "ok":
+            print(f"{status.upper():<12} {key:<70} "
+                  f"{format_time(before)} -> {format_time(after)} "
+                  f"({ratio:.2f}x)")
+        regressions += status == "regression"
+    print(f"{regressions} regression(s) beyond "
+          f"{args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
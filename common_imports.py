@@ -1,15 +1,31 @@
+import atexit
 import logging
+import os
+import queue
 import sys
+import threading
+import time
+from collections import Counter, OrderedDict
 import config as cfg
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, \
+    QueueListener
 
-try:
-    from colorlog import ColoredFormatter
+FORMAT = "  %(log_color)s%(levelname)-8s%(reset)s | " \
+         "%(blue)s%(message)s%(reset)s " \
+         "--- %(filename) -2s%(lineno)d"
 
-    FORMAT = "  %(log_color)s%(levelname)-8s%(reset)s | " \
-             "%(blue)s%(message)s%(reset)s " \
-             "--- %(filename) -2s%(lineno)d"
-    CONSOLE_FORMATTER = ColoredFormatter(
+
+def get_console_formatter():
+    """
+    Colored formatter if colorlog is installed, plain otherwise.
+    colorlog is only imported once the first record is logged.
+    """
+    try:
+        from colorlog import ColoredFormatter
+    except ImportError:
+        # No color available, use default config
+        return logging.Formatter("%(levelname)s: %(message)s")
+    return ColoredFormatter(
         FORMAT,
         log_colors={
             'DEBUG': 'cyan',
@@ -19,42 +35,220 @@ try:
             'CRITICAL': 'red',
         }
     )
-except ImportError:
-    # No color available, use default config
-    CONSOLE_FORMATTER = logging.Formatter("%(levelname)s: %(message)s")
-    color_disabled = True
-else:
-    color_disabled = False
+
+
+__all__ = ["logging", "sys", "cfg", "FILE_FORMATTER", "LOG_FILE",
+           "get_console_formatter", "get_console_handler",
+           "get_file_handler", "get_logger", "set_level", "error_counts",
+           "shutdown_logging", "LogFlags", "LOG_FLAGS", "RepeatFilter"]
 
 LOG_FILE = cfg.PATHS["LOGS"]
 FILE_FORMATTER = logging.Formatter("%(asctime)s — %(name)s — %("
                                    "levelname)s — %(message)s")
 
+# Repeats of one message within this many seconds are only counted
+REPEAT_INTERVAL = 5.
+# Distinct messages tracked for repeats; f-string messages make a new
+# one per value, so the least recently seen are forgotten
+MAX_REPEAT_KEYS = 1024
+
+
+class LogFlags:
+    """
+    Plain attributes mirroring the logging level, so hot loops can
+    skip building messages with a single attribute check:
+    ``if LOG_FLAGS.debug: log.debug(f"...")``.  Kept in sync by
+    set_level.
+    """
+
+    def __init__(self, level=logging.DEBUG):
+        self.update(level)
+
+    def update(self, level):
+        self.level = level
+        self.debug = level <= logging.DEBUG
+        self.info = level <= logging.INFO
+        self.warning = level <= logging.WARNING
+        self.error = level <= logging.ERROR
+        return None
+
+
+LOG_FLAGS = LogFlags()
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Rate limits repeated messages.  The first record of a message goes
+    through; repeats within interval seconds are dropped and counted,
+    and the next record let through after the interval reports how
+    many were dropped.  Messages are keyed on logger, level and the
+    unformatted message, so an error hit once per gene costs a counter
+    increment rather than console and file I/O.  Only the max_keys
+    most recently seen messages are tracked.
+    """
+
+    def __init__(self, interval=REPEAT_INTERVAL, max_keys=MAX_REPEAT_KEYS):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self.counts = Counter()
+        self._last = OrderedDict()
+        self._suppressed = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            self.counts[key] += 1
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._last.move_to_end(key)
+                self._suppressed[key] += 1
+                return False
+            self._last[key] = now
+            self._last.move_to_end(key)
+            while len(self._last) > self.max_keys:
+                oldest, _ = self._last.popitem(last=False)
+                del self.counts[oldest]
+                self._suppressed.pop(oldest, None)
+            repeats = self._suppressed.pop(key, 0)
+        if repeats:
+            record.msg = f"{record.msg} (repeated {repeats} more " \
+                         f"times)"
+        return True
+
+    def pending(self):
+        """
+        Dropped repeats not yet reported, by key.
+        """
+        with self._lock:
+            return dict(self._suppressed)
+
+
+class _QueueHandler(QueueHandler):
+
+    def enqueue(self, record):
+        # Forked children inherit the handler but not the listener
+        # thread, so they start their own on first use
+        if _STATE.pid != os.getpid():
+            _start_listener()
+        _STATE.queue.put_nowait(record)
+
+
+class _State:
+    """
+    Process wide logging setup: one console and one file handler,
+    owned by a QueueListener thread, and one QueueHandler shared by
+    every logger from get_logger.  The listener and its handlers are
+    created when the first record is logged, so importing a module
+    costs no thread, file or colorlog import.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.queue = None
+        self.handler = _QueueHandler(None)
+        self.listener = None
+        self.repeats = RepeatFilter()
+        self.loggers = {}
+        self.pid = None
+
+
+_STATE = _State()
+
 
 def get_console_handler():
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(CONSOLE_FORMATTER)
+    console_handler.setFormatter(get_console_formatter())
     return console_handler
 
 
 def get_file_handler():
-    file_handler = TimedRotatingFileHandler(LOG_FILE, when='midnight')
+    # The file is only opened once something is written to it
+    file_handler = TimedRotatingFileHandler(LOG_FILE, when='midnight',
+                                            delay=True)
     file_handler.setFormatter(FILE_FORMATTER)
     return file_handler
 
 
+def _start_listener():
+    with _STATE.lock:
+        if _STATE.pid == os.getpid():
+            return None
+        _STATE.queue = queue.SimpleQueue()
+        _STATE.handler.queue = _STATE.queue
+        _STATE.listener = QueueListener(_STATE.queue,
+                                        get_console_handler(),
+                                        get_file_handler(),
+                                        respect_handler_level=True)
+        _STATE.listener.start()
+        _STATE.pid = os.getpid()
+    return None
+
+
+def shutdown_logging():
+    """
+    Report dropped repeats and flush everything queued.  Registered
+    to run at exit.
+    """
+    if _STATE.listener is None or _STATE.pid != os.getpid():
+        return None
+    for (name, levelno, msg), num in _STATE.repeats.pending().items():
+        _STATE.listener.handle(logging.LogRecord(
+            name, levelno, "", 0,
+            f"{msg} (repeated {num} more times)", None, None))
+    _STATE.listener.stop()
+    _STATE.listener = None
+    _STATE.pid = None
+    return None
+
+
+atexit.register(shutdown_logging)
+
+
+def set_level(level):
+    """
+    Set the level of every logger from get_logger and of LOG_FLAGS.
+    """
+    LOG_FLAGS.update(level)
+    for logger in _STATE.loggers.values():
+        logger.setLevel(level)
+    return None
+
+
+def error_counts():
+    """
+    How often each message was logged, dropped repeats included, for
+    the MAX_REPEAT_KEYS most recently seen messages.
+    :return: Counter keyed on (logger name, level, message)
+    """
+    return Counter(_STATE.repeats.counts)
+
+
 def get_logger(logger_name):
+    """
+    Logger whose records go through the shared queue to the console
+    and log file.  Calling it again for the same name returns the
+    same logger without adding handlers.
+    """
     logger = logging.getLogger(logger_name)
-    logger.setLevel(
-        logging.DEBUG)  # better to have too much log than not enough
-    logger.addHandler(get_console_handler())
-    logger.addHandler(get_file_handler())
-    logger.propagate = False
+    with _STATE.lock:
+        if logger_name in _STATE.loggers:
+            return logger
+        logger.setLevel(LOG_FLAGS.level)
+        logger.addHandler(_STATE.handler)
+        logger.addFilter(_STATE.repeats)
+        logger.propagate = False
+        _STATE.loggers[logger_name] = logger
     return logger
 
 
 def main():
-    pass
+    log = get_logger(__name__)
+    for _ in range(1000):
+        log.error("Hot path error")
+    print(error_counts())
 
 
 if __name__ == "__main__":
@@ -64,7 +64,7 @@ def set_speed(speed_menu):
         return 0.001
 
 
-def evolve(ax, canvas, time_interval, pop_size, gens):
+def evolve(window, ax, canvas, time_interval, pop_size, gens):
     # Initialize the population
 
     nums = choice(range(256), pop_size)
@@ -75,7 +75,7 @@ def evolve(ax, canvas, time_interval, pop_size, gens):
         person.apply(fit)
         pop.add(person)
 
-    VisualSimpleExperiment(
+    experiment = VisualSimpleExperiment(
         ax,
         canvas,
         time_interval,
@@ -84,8 +84,11 @@ def evolve(ax, canvas, time_interval, pop_size, gens):
         p_cross=.9,
         p_mutate=.001,
         fitness_func=fit
-    ).run()
-    return None
+    )
+    # Evolve off the Tk thread; the window's timer shows the frames
+    experiment.start()
+    experiment.animate(window)
+    return experiment
 
 # def matrix():
 #     import numpy as np
@@ -151,7 +154,16 @@ def main():
     fig = plt.figure()
     ax = fig.add_subplot(111)  # create axis
     ax.axis('off')
-    canvas = FigureCanvasTkAgg(fig, master=window)
+    figure_canvas = FigureCanvasTkAgg(fig, master=window)
+    figure_canvas.get_tk_widget().grid(row=2, column=0, padx=10, pady=5)
+    experiments = []
+
+    def close():
+        for experiment in experiments:
+            experiment.stop()
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", close)
 
     population_size = IntVar()
     size_list = [2, 10, 25, 100]
@@ -218,7 +230,8 @@ def main():
     b1 = Button(
         UI_frame,
         text="Evolve",
-        command=lambda: evolve(ax, canvas, .3, 10, 10),
+        command=lambda: experiments.append(
+            evolve(window, ax, figure_canvas, .3, 10, 10)),
         bg=cfg.COLORS["LIGHT_GREEN"]
     )
     b1.grid(row=2, column=1, padx=5, pady=5)
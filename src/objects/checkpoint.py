@@ -0,0 +1,177 @@
+import os
+import pickle
+import random
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+from src.objects.individual import Fittest
+from src.objects.packed import PackedPopulation
+from src.objects.diploid import DiploidPopulation
+from common_imports import *
+
+log = get_logger(__name__)
+
+GENES = "genes.npy"
+FITNESS = "fitness.npy"
+HOF_GENES = "hall_of_fame_genes.npy"
+HOF_FITNESS = "hall_of_fame_fitness.npy"
+STATE = "state.pkl"
+
+
+def _backup(path):
+    return path.with_name(path.name + ".old")
+
+
+def _save(path, array):
+    """
+    np.save that only returns once the data is on disk.
+    """
+    with open(path, "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    return None
+
+
+def _sync_dir(path):
+    """
+    Flush a directory's entries (new files, renames) to disk.
+    """
+    if os.name != "posix":
+        return None
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return None
+
+
+def save_checkpoint(path, population: PackedPopulation, generation,
+                    config=None):
+    """
+    Snapshot a packed population, its hall of fame, the generation
+    counter and both RNG states into the directory path.  Genes are
+    stored bit-packed as .npy.  The snapshot is written and synced to
+    a temporary directory and renamed into place, so a crash mid-write
+    leaves the previous checkpoint intact.
+    A DiploidPopulation is stored with its dominance map and loads
+    back as one.
+
+    :param path: Checkpoint directory
+    :param population: PackedPopulation to save
+    :param generation: Number of generations completed
+    :param config: Optional picklable experiment settings
+    :return: None
+    """
+    path = Path(path)
+    tmp = Path(tempfile.mkdtemp(prefix=path.name + ".",
+                                dir=path.parent))
+    try:
+        _save(tmp / GENES, population.packed())
+        _save(tmp / FITNESS, population.fitness)
+        hall_of_fame = population.hall_of_fame
+        hof = None
+        if hall_of_fame is not None:
+            members = hall_of_fame.queue
+            genes = np.zeros((len(members), population.num_loci),
+                             np.uint8)
+            for idx, person in enumerate(members):
+                genes[idx] = person.to_array()
+            _save(tmp / HOF_GENES, np.packbits(genes, axis=1))
+            _save(tmp / HOF_FITNESS,
+                  np.array([person.fitness for person in members]))
+            hof = {"num": hall_of_fame.num,
+                   "dedupe": hall_of_fame.dedupe}
+        state = {
+            "generation": generation,
+            "layout": population.layout,
+            "dominance": getattr(population, "dominance", None),
+            "num_loci": population.num_loci,
+            "hall_of_fame": hof,
+            "numpy_rng": np.random.get_state(),
+            "python_rng": random.getstate(),
+            "config": config or {},
+        }
+        with open(tmp / STATE, "wb") as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        _sync_dir(tmp)
+        # Swap the new snapshot in with renames only
+        backup = _backup(path)
+        if path.exists():
+            # Drop a backup left over from an interrupted save
+            shutil.rmtree(backup, ignore_errors=True)
+            os.replace(path, backup)
+        os.replace(tmp, path)
+        _sync_dir(path.parent)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    shutil.rmtree(backup, ignore_errors=True)
+    return None
+
+
+def load_checkpoint(path, restore_rng=True):
+    """
+    Load a checkpoint written by save_checkpoint.
+    :param path: Checkpoint directory
+    :param restore_rng: Also restore the NumPy and random RNG states
+    :return: Dict with population, generation and config
+    """
+    path = Path(path)
+    if not path.exists() and _backup(path).exists():
+        # Crashed between the two renames of save_checkpoint
+        path = _backup(path)
+    with open(path / STATE, "rb") as f:
+        state = pickle.load(f)
+    num_chromosomes, num_codons, codon_length = state["layout"]
+    layout = {"codon_length": codon_length,
+              "num_codons": num_codons,
+              "num_chromosomes": num_chromosomes}
+    population_class = PackedPopulation
+    if state.get("dominance") is not None:
+        population_class = DiploidPopulation
+        layout["num_chromosomes"] //= 2
+        layout["dominance"] = state["dominance"]
+    hall_of_fame = None
+    if state["hall_of_fame"] is not None:
+        hall_of_fame = Fittest(**state["hall_of_fame"])
+        best = population_class.from_packed(
+            np.load(path / HOF_GENES), state["num_loci"],
+            fitness=np.load(path / HOF_FITNESS), **layout)
+        hall_of_fame.add_many(best.fitness, best.detach)
+    population = population_class.from_packed(
+        np.load(path / GENES), state["num_loci"],
+        fitness=np.load(path / FITNESS), hall_of_fame=hall_of_fame,
+        **layout)
+    if restore_rng:
+        np.random.set_state(state["numpy_rng"])
+        random.setstate(state["python_rng"])
+    return {"population": population,
+            "generation": state["generation"],
+            "config": state["config"]}
+
+
+def main():
+    from src.objects.fitness import number_ones
+
+    pop = PackedPopulation(np.random.randint(0, 2, (1000, 64)),
+                           codon_length=64,
+                           hall_of_fame=Fittest(3))
+    pop.apply_fitness(number_ones)
+    pop.hall_of_fame.add_many(pop.fitness, pop.detach)
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "checkpoint"
+        save_checkpoint(path, pop, generation=0)
+        print(sorted(os.listdir(path)))
+        loaded = load_checkpoint(path)["population"]
+        print((loaded.genes == pop.genes).all(),
+              loaded.average_fitness(), pop.average_fitness())
+        print(loaded.hall_of_fame)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,7 @@ class Codon:
                  num=0,
                  bitstring="",
                  length=8):
-        self.encoder = h.Encoder(max_len=length)
+        self.encoder = h.get_encoder(max_len=length)
         self._num = num
         if not bitstring:
             self._bitstring = self.encode()
@@ -39,18 +39,39 @@ class Codon:
         return self.encoder.encode_num_to_bitstring(self._num)
 
     def decode(self):
-        return self.encoder.decode_bitstring_to_num(self._num)
+        return self.encoder.decode_bitstring_to_num(self._bitstring)
+
+    def copy(self):
+        """
+        Cheap copy of the codon.  Bitstrings are immutable and the
+        encoder is shared, so nothing is duplicated.
+        """
+        codon = Codon.__new__(Codon)
+        codon.encoder = self.encoder
+        codon._num = self._num
+        codon._bitstring = self._bitstring
+        return codon
 
     def mutate(self, position):
-        temp = list(self._bitstring)
-        try:
-            if temp[position] == "0":
-                temp[position] = "1"
-            else:
-                temp[position] = "0"
-            self._bitstring = "".join(temp)
-        except KeyError:
-            log.error("Position for mutation is out of bounds")
+        return self.mutate_many([position])
+
+    def mutate_many(self, positions):
+        """
+        Flip the bits at all the given positions with a single XOR on
+        the integer value of the bitstring.
+        :param positions: Iterable of 0 based positions
+        :return: None
+        """
+        length = self.__len__()
+        mask = 0
+        for position in positions:
+            if not 0 <= position < length:
+                log.error("Position for mutation is out of bounds")
+                return None
+            mask ^= 1 << (length - position - 1)
+        if mask:
+            self._bitstring = format(int(self._bitstring, 2) ^ mask,
+                                     f"0{length}b")
         return None
 
     def fuse(self,
@@ -106,6 +127,7 @@ class Chromosome:
         self._codons = codons
         self._num_codons = len(codons)
         self._codon_lengths = len(codons[0])
+        self._shared = False
 
     def __repr__(self):
         ans = ""
@@ -125,6 +147,21 @@ class Chromosome:
     def codon_lengths(self):
         return self._codon_lengths
 
+    def clone(self):
+        """
+        Copy-on-write clone.  The clone shares the codon list with the
+        calling chromosome until either of them is mutated, at which
+        point the mutated one takes private copies of its codons.
+        :return: Chromosome with the same genes
+        """
+        chrom = Chromosome.__new__(Chromosome)
+        chrom._codons = self._codons
+        chrom._num_codons = self._num_codons
+        chrom._codon_lengths = self._codon_lengths
+        chrom._shared = True
+        self._shared = True
+        return chrom
+
     def to_list(self):
         full_chromosome = ""
         for item in self._codons:
@@ -166,10 +203,14 @@ class Chromosome:
         codon.  Key value pairs are (codon_index, [positions])
         :return: None
         """
+        if not any(positions.values()):
+            return None
+        if self._shared:
+            self._codons = [codon.copy() for codon in self._codons]
+            self._shared = False
         codons = self.codons
         for codon in positions:
-            for position in positions[codon]:
-                codons[codon].mutate(position)
+            codons[codon].mutate_many(positions[codon])
         return None
 
 def main():
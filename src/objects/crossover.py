@@ -0,0 +1,192 @@
+import numpy as np
+from common_imports import *
+
+log = get_logger(__name__)
+
+
+class Crossover:
+    """
+    Base class for crossover operators on gene matrices.  Calling one
+    crosses every mating pair of a generation at once: mask() draws a
+    boolean swap mask with one row per pair, each pair is crossed at
+    all with probability p_cross, and the children are the parents
+    with the masked loci exchanged.
+    """
+    name = None
+
+    def __init__(self, p_cross=1.):
+        self.p_cross = p_cross
+
+    def mask(self, num_pairs, layout):
+        """
+        Loci to exchange between the parents of every pair.
+        :param num_pairs: Number of mating pairs
+        :param layout: (num_chromosomes, num_codons, codon_length)
+        :return: bool array of shape (num_pairs, num_loci)
+        """
+        raise NotImplementedError
+
+    def draw(self, num_pairs, layout):
+        """
+        mask(), with the rows of pairs that are not crossed cleared.
+        """
+        swap = self.mask(num_pairs, layout)
+        swap &= (np.random.random(num_pairs) < self.p_cross)[:, None]
+        return swap
+
+    def __call__(self, mothers, fathers, layout):
+        """
+        :param mothers: Gene matrix of first parents
+        :param fathers: Gene matrix of second parents, same shape
+        :param layout: (num_chromosomes, num_codons, codon_length)
+        :return: Pair of child gene matrices
+        """
+        swap = self.draw(mothers.shape[0], layout)
+        # Children differ from their parents exactly where swap is set
+        diff = (mothers ^ fathers) & swap
+        return mothers ^ diff, fathers ^ diff
+
+
+def _num_loci(layout):
+    num_chromosomes, num_codons, codon_length = layout
+    return num_chromosomes * num_codons * codon_length
+
+
+def _parity_mask(cuts, num_loci):
+    """
+    Mask that flips at every cut: locus i is set when an odd number
+    of cuts lie at or before i.  Coinciding cuts cancel out.
+    """
+    num_pairs = cuts.shape[0]
+    toggles = np.zeros((num_pairs, num_loci + 1), dtype=np.uint8)
+    np.bitwise_xor.at(toggles, (np.arange(num_pairs)[:, None], cuts), 1)
+    return np.bitwise_xor.accumulate(toggles[:, :num_loci], axis=1) \
+        .astype(bool)
+
+
+class SinglePointCrossover(Crossover):
+    """
+    Every codon gets its own single cut and the loci at or past it are
+    swapped, matching Chromosome.fuse with crosspoints cut + 1.  For
+    one-codon genomes this is classic single point crossover.
+    """
+    name = "single"
+
+    def mask(self, num_pairs, layout):
+        num_chromosomes, num_codons, codon_length = layout
+        cuts = np.random.randint(
+            0, codon_length,
+            (num_pairs, num_chromosomes * num_codons, 1))
+        return (np.arange(codon_length) >= cuts).reshape(num_pairs, -1)
+
+
+class TwoPointCrossover(Crossover):
+    """
+    The segment between two cuts anywhere in the genome is swapped.
+    """
+    name = "two_point"
+
+    def mask(self, num_pairs, layout):
+        num_loci = _num_loci(layout)
+        cuts = np.sort(np.random.randint(0, num_loci + 1,
+                                         (num_pairs, 2, 1)), axis=1)
+        loci = np.arange(num_loci)
+        return (loci >= cuts[:, 0]) & (loci < cuts[:, 1])
+
+
+class KPointCrossover(Crossover):
+    """
+    k cuts anywhere in the genome, with every other segment swapped.
+    Cuts are drawn independently, so coinciding cuts cancel.
+    """
+    name = "k_point"
+
+    def __init__(self, p_cross=1., k=3):
+        super().__init__(p_cross)
+        self.k = k
+
+    def mask(self, num_pairs, layout):
+        num_loci = _num_loci(layout)
+        cuts = np.random.randint(1, max(num_loci, 2),
+                                 (num_pairs, self.k))
+        return _parity_mask(cuts, num_loci)
+
+
+class UniformCrossover(Crossover):
+    """
+    Each locus is swapped independently with probability p_swap.
+    """
+    name = "uniform"
+
+    def __init__(self, p_cross=1., p_swap=.5):
+        super().__init__(p_cross)
+        self.p_swap = p_swap
+
+    def mask(self, num_pairs, layout):
+        shape = (num_pairs, _num_loci(layout))
+        if self.p_swap == .5:
+            return np.random.randint(0, 2, shape, dtype=bool)
+        return np.random.random(shape) < self.p_swap
+
+
+class CodonBoundaryCrossover(Crossover):
+    """
+    k-point crossover with cuts only between codons, so codons are
+    passed on whole.  Genomes of a single codon are never changed.
+    """
+    name = "codon"
+
+    def __init__(self, p_cross=1., k=1):
+        super().__init__(p_cross)
+        self.k = k
+
+    def mask(self, num_pairs, layout):
+        num_chromosomes, num_codons, codon_length = layout
+        total_codons = num_chromosomes * num_codons
+        if total_codons < 2:
+            return np.zeros((num_pairs, _num_loci(layout)), dtype=bool)
+        cuts = np.random.randint(1, total_codons, (num_pairs, self.k))
+        codons = _parity_mask(cuts, total_codons)
+        return np.repeat(codons, codon_length, axis=1)
+
+
+CROSSOVER_METHODS = {
+    method.name: method for method in (
+        SinglePointCrossover,
+        TwoPointCrossover,
+        KPointCrossover,
+        UniformCrossover,
+        CodonBoundaryCrossover,
+    )
+}
+
+
+def get_crossover(method="single", p_cross=1., **kwargs):
+    """
+    Build a crossover operator by name.
+    :param method: Key of CROSSOVER_METHODS, or a Crossover instance
+    which is returned unchanged
+    :param p_cross: Probability that a mating pair is crossed at all
+    :param kwargs: Parameters for the operator, e.g. k or p_swap
+    :return: Crossover object, or None for unknown methods
+    """
+    if isinstance(method, Crossover):
+        return method
+    if method not in CROSSOVER_METHODS:
+        log.error(f"Method {method} not implemented")
+        return None
+    return CROSSOVER_METHODS[method](p_cross, **kwargs)
+
+
+def main():
+    layout = (1, 4, 4)
+    mothers = np.zeros((3, 16), dtype=np.uint8)
+    fathers = np.ones((3, 16), dtype=np.uint8)
+    for method in CROSSOVER_METHODS:
+        child, _ = get_crossover(method)(mothers, fathers, layout)
+        print(f"{method:>10}: ", "  ".join(
+            "".join(map(str, row)) for row in child))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+from src.objects.packed import PackedPopulation
+from src.objects.crossover import Crossover, get_crossover
+from src.objects.fitness import is_batch, is_cacheable, evaluate_batch
+import numpy as np
+from common_imports import *
+
+log = get_logger(__name__)
+
+
+# ---------------------------------------------------------------------
+# Dominance maps turn the two homologs of every individual into the
+# phenotype that fitness functions see.
+# ---------------------------------------------------------------------
+
+class Dominance:
+    """
+    Base class for dominance maps.  express() works on the homolog
+    stack of a whole population at once.  Binary maps express 0/1
+    alleles and so work with every fitness function; other maps need
+    a batch fitness function that understands their values.
+    """
+    name = None
+    binary = True
+
+    def express(self, homologs, out=None):
+        """
+        :param homologs: uint8 array of shape (size, 2, num_loci)
+        :param out: Optional uint8 array of shape (size, num_loci)
+        :return: Phenotype matrix of shape (size, num_loci)
+        """
+        raise NotImplementedError
+
+
+class CompleteDominance(Dominance):
+    """
+    One allele is dominant at every locus: a heterozygote expresses
+    the dominant allele.
+    """
+    name = "complete"
+
+    def __init__(self, dominant=1):
+        self.dominant = dominant
+
+    def express(self, homologs, out=None):
+        if self.dominant:
+            return np.bitwise_or(homologs[:, 0], homologs[:, 1], out=out)
+        return np.bitwise_and(homologs[:, 0], homologs[:, 1], out=out)
+
+
+class Codominance(Dominance):
+    """
+    Both alleles are expressed.  The phenotype is the allele dosage,
+    i.e. the number of copies of allele 1 (0, 1 or 2) at each locus.
+    """
+    name = "codominant"
+    binary = False
+
+    def express(self, homologs, out=None):
+        return np.add(homologs[:, 0], homologs[:, 1], out=out)
+
+
+class MaskDominance(Dominance):
+    """
+    Dominance set per locus: where mask is set allele 1 is dominant,
+    elsewhere allele 0 is.
+    """
+    name = "mask"
+
+    def __init__(self, mask):
+        self.mask = np.asarray(mask, dtype=np.uint8)
+
+    def express(self, homologs, out=None):
+        first, second = homologs[:, 0], homologs[:, 1]
+        # Homozygous loci express their allele, heterozygous the mask
+        out = np.bitwise_xor(first, second, out=out)
+        out &= self.mask
+        out |= first & second
+        return out
+
+
+DOMINANCE_MAPS = {
+    method.name: method for method in (
+        CompleteDominance,
+        Codominance,
+        MaskDominance,
+    )
+}
+
+
+def get_dominance(method="complete", **kwargs):
+    """
+    Build a dominance map by name.
+    :param method: Key of DOMINANCE_MAPS, or a Dominance instance which
+    is returned unchanged
+    :param kwargs: Parameters for the map, e.g. dominant or mask
+    :return: Dominance object, or None for unknown methods
+    """
+    if isinstance(method, Dominance):
+        return method
+    if method not in DOMINANCE_MAPS:
+        log.error(f"Dominance map {method} not implemented")
+        return None
+    return DOMINANCE_MAPS[method](**kwargs)
+
+
+# ---------------------------------------------------------------------
+# Meiosis
+# ---------------------------------------------------------------------
+
+class Meiosis(Crossover):
+    """
+    Sexual reproduction of diploids.  Every parent forms a gamete per
+    child: each of its chromosomes starts on a random homolog
+    (independent assortment) and switches homolog wherever the
+    recombination operator's mask is set.  A child is one gamete from
+    its mother and one from its father.
+
+    Any Crossover serves as the recombination map, applied to one
+    chromosome at a time; its p_cross is the chance that a chromosome
+    recombines at all.
+    """
+    name = "meiosis"
+
+    def __init__(self, recombination):
+        super().__init__(recombination.p_cross)
+        self.recombination = recombination
+
+    def gametes(self, genomes, layout):
+        """
+        One gamete per genome.
+        :param genomes: Diploid gene matrix, homologs side by side
+        :param layout: Diploid layout (2 * num_chromosomes,
+        num_codons, codon_length)
+        :return: Haploid gene matrix
+        """
+        num_chromosomes, num_codons, codon_length = layout
+        num_chromosomes //= 2
+        num = genomes.shape[0]
+        homologs = genomes.reshape(num, 2, num_chromosomes, -1)
+        switch = self.recombination.draw(
+            num * num_chromosomes, (1, num_codons, codon_length))
+        switch = switch.reshape(num, num_chromosomes, -1)
+        switch ^= np.random.randint(0, 2, (num, num_chromosomes, 1),
+                                    dtype=bool)
+        first = homologs[:, 0]
+        gametes = first ^ ((first ^ homologs[:, 1]) & switch)
+        return gametes.reshape(num, -1)
+
+    def __call__(self, mothers, fathers, layout):
+        children = []
+        for _ in range(2):
+            children.append(np.concatenate(
+                (self.gametes(mothers, layout),
+                 self.gametes(fathers, layout)), axis=1))
+        return children[0], children[1]
+
+
+def get_meiosis(recombination="single", p_cross=1., **kwargs):
+    """
+    Build a Meiosis operator around a named recombination map.
+    :param recombination: Key of CROSSOVER_METHODS, a Crossover used
+    as the recombination map, or a Meiosis returned unchanged
+    :param p_cross: Probability that a chromosome recombines
+    :param kwargs: Parameters for the recombination operator
+    :return: Meiosis object, or None for unknown methods
+    """
+    if isinstance(recombination, Meiosis):
+        return recombination
+    recombination = get_crossover(recombination, p_cross, **kwargs)
+    if recombination is None:
+        return None
+    return Meiosis(recombination)
+
+
+class DiploidPopulation(PackedPopulation):
+    """
+    PackedPopulation of diploid individuals.  Each row holds two
+    homologous copies of a num_chromosomes x num_codons x codon_length
+    genome side by side, so the gene matrix is a (size, 2, num_loci)
+    stack of homologs viewed as two dimensions, and layout counts
+    2 * num_chromosomes chromosomes.  Mutation, selection, checkpoints
+    and drawing work on the full genotype; fitness is evaluated on the
+    phenotype the dominance map expresses.
+    """
+
+    def __init__(self,
+                 genes,
+                 codon_length=None,
+                 num_codons=1,
+                 num_chromosomes=1,
+                 fitness=None,
+                 hall_of_fame=None,
+                 dominance="complete"
+                 ):
+        super().__init__(genes,
+                         codon_length=codon_length,
+                         num_codons=num_codons,
+                         num_chromosomes=2 * num_chromosomes,
+                         fitness=fitness,
+                         hall_of_fame=hall_of_fame)
+        self._dominance = get_dominance(dominance)
+        if self._dominance is None:
+            raise ValueError(f"Unknown dominance map {dominance}")
+        self._phenotype = None
+
+    @classmethod
+    def from_homologs(cls, first, second, **kwargs):
+        """
+        Pair up two haploid gene matrices, row by row.
+        :param first: Gene matrix of the first homologs
+        :param second: Gene matrix of the second homologs, same shape
+        :return: DiploidPopulation
+        """
+        return cls(np.concatenate((first, second), axis=1), **kwargs)
+
+    @classmethod
+    def from_population(cls, population, dominance="complete"):
+        """
+        Pack an object population of diploid individuals, whose
+        chromosomes are the first homologs followed by the second.
+        :param population: Population of Individual objects
+        :param dominance: Dominance map name or object
+        :return: DiploidPopulation
+        """
+        packed = PackedPopulation.from_population(population)
+        if packed.num_chromosomes % 2:
+            raise ValueError("Diploid individuals need an even number "
+                             "of chromosomes")
+        return cls(packed.genes,
+                   codon_length=packed.codon_length,
+                   num_codons=packed.num_codons,
+                   num_chromosomes=packed.num_chromosomes // 2,
+                   fitness=packed.fitness,
+                   hall_of_fame=packed.hall_of_fame,
+                   dominance=dominance)
+
+    @property
+    def dominance(self):
+        return self._dominance
+
+    @property
+    def haploid_layout(self):
+        num_chromosomes, num_codons, codon_length = self._layout
+        return num_chromosomes // 2, num_codons, codon_length
+
+    @property
+    def homologs(self):
+        """
+        View of the genes as a (size, 2, num_loci) homolog stack.
+        """
+        return self._genes.reshape(self.population_size, 2, -1)
+
+    def phenotype(self, out=None):
+        """
+        Expressed phenotype of every individual.
+        :param out: Optional uint8 array to fill
+        :return: Phenotype matrix, one row per individual
+        """
+        return self._dominance.express(self.homologs, out=out)
+
+    def expressed(self, rows=None):
+        """
+        Haploid PackedPopulation over the phenotype, sharing this
+        population's fitness vector.  The phenotype buffer is reused,
+        so the result is only valid until the next call.
+        :param rows: Optional row indices to express; the result then
+        holds a copy of their fitness
+        """
+        num_chromosomes, num_codons, codon_length = self.haploid_layout
+        if rows is not None:
+            return PackedPopulation(
+                self._dominance.express(self.homologs[rows]),
+                codon_length=codon_length,
+                num_codons=num_codons,
+                num_chromosomes=num_chromosomes,
+                fitness=self._fitness[rows])
+        shape = (self.population_size, self.num_loci // 2)
+        if self._phenotype is None or self._phenotype.shape != shape:
+            self._phenotype = np.empty(shape, dtype=np.uint8)
+        return PackedPopulation(self.phenotype(out=self._phenotype),
+                                codon_length=codon_length,
+                                num_codons=num_codons,
+                                num_chromosomes=num_chromosomes,
+                                fitness=self._fitness)
+
+    def apply_fitness(self, func, pool=None, cache=None, rows=None):
+        """
+        Evaluate fitness of the expressed phenotypes.  Binary
+        dominance maps go through the haploid evaluation path (batch,
+        pool and cache alike); other maps need a batch function,
+        evaluated in process with the cache keyed on the genotype.
+        :param func: Fitness function
+        :param pool: Optional FitnessPool to evaluate in parallel
+        :param cache: Optional FitnessCache
+        :param rows: Optional distinct row indices to evaluate, see
+        PackedPopulation.apply_fitness
+        :return: None
+        """
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        phenotype = self.expressed(rows)
+        if self._dominance.binary:
+            phenotype.apply_fitness(func, pool, cache)
+        elif not is_batch(func):
+            raise ValueError(f"Dominance map {self._dominance.name} "
+                             f"needs a batch fitness function")
+        elif cache is not None and is_cacheable(func):
+            genotype = self._genes if rows is None else self._genes[rows]
+            phenotype.fitness[:] = cache.evaluate(
+                func, genotype,
+                lambda sub: evaluate_batch(func, phenotype.genes[sub]))
+        else:
+            phenotype.fitness[:] = evaluate_batch(func, phenotype.genes)
+        if rows is None:
+            self._selection = None
+            return None
+        self._fitness[rows] = phenotype.fitness
+        if self._selection is not None:
+            self._selection.update(rows, phenotype.fitness)
+        return None
+
+    def decode(self, low=None, high=None, gray=False):
+        """
+        Decode the codons of the expressed phenotypes, see
+        PackedPopulation.decode.
+        """
+        if not self._dominance.binary:
+            log.error("Only binary phenotypes can be decoded")
+            return None
+        return self.expressed().decode(low, high, gray)
+
+    def evolve_one_step(self,
+                        p_cross,
+                        p_mutate,
+                        fitness_func,
+                        pool=None,
+                        cache=None,
+                        selection="roulette",
+                        crossover="single",
+                        replacement="generational"
+                        ):
+        """
+        Breed a generation through the default GenerationPipeline
+        with meiosis in place of crossover.
+        :param crossover: Recombination method name, Crossover or
+        Meiosis object
+        :param replacement: Replacement method name or Replacement
+        object
+        :return: None
+        """
+        from src.objects.experiment import GenerationPipeline
+
+        meiosis = get_meiosis(crossover, p_cross)
+        if meiosis is None:
+            raise ValueError(f"Unknown crossover method {crossover}")
+        GenerationPipeline.build(p_cross, p_mutate, fitness_func,
+                                 pool=pool,
+                                 cache=cache,
+                                 selection=selection,
+                                 hall_of_fame=self.hall_of_fame,
+                                 crossover=meiosis,
+                                 replacement=replacement
+                                 ).step(self)
+        return None
+
+
+def main():
+    from src.objects.fitness import number_ones
+
+    genes = np.random.randint(0, 2, (4, 16), dtype=np.uint8)
+    mask = np.tile([1, 0], 4)
+    for dominance in (CompleteDominance(), CompleteDominance(0),
+                      Codominance(), MaskDominance(mask)):
+        pop = DiploidPopulation(genes, dominance=dominance)
+        print(f"{dominance.name:>10}: ", "  ".join(
+            "".join(map(str, row)) for row in pop.phenotype()))
+    pop = DiploidPopulation(np.random.randint(0, 2, (1000, 128),
+                                              dtype=np.uint8),
+                            codon_length=16, num_codons=4)
+    for _ in range(20):
+        pop.evolve_one_step(.9, .002, number_ones, crossover="k_point")
+    print("Average fitness: ", pop.average_fitness())
+
+
+if __name__ == "__main__":
+    main()
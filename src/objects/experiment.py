@@ -1,29 +1,570 @@
-import copy
-import time
+import abc
+import heapq
+import threading
+import numpy as np
 from src.objects.individual import Individual, Population, Fittest
 from src.objects.chromosome import Chromosome, Codon
+from src.objects.packed import PackedPopulation, IndividualView
+from src.objects.shared import SharedPopulation
+from src.objects.parallel import FitnessPool
+from src.objects.fitness import FitnessCache
+from src.objects.mutation import sparse_mutation
+from src.objects.selection import get_selection
+from src.objects.crossover import get_crossover
+from src.objects.diploid import DiploidPopulation, get_meiosis
+from src.objects.checkpoint import save_checkpoint, load_checkpoint
+from src.utils.profiling import NO_STAGE
+from src.objects.rendering import FrameBuffer, FramePlayer, \
+    FrameRenderer
 from numpy.random import choice
-import random
-from tqdm import tqdm
-from copy import deepcopy
 from common_imports import *
 
 log = get_logger(__name__)
 
 
+# ---------------------------------------------------------------------
+# Generation pipeline stages.  Every stage works on a whole generation
+# at once; swap any of them to change how a GenerationPipeline breeds.
+# ---------------------------------------------------------------------
+
+class Evaluate:
+    """
+    Evaluation stage: fills in fitness for every individual that does
+    not have one yet, optionally on a FitnessPool and through a
+    FitnessCache.  Individuals that already have fitness are not
+    evaluated again; a replacement stage that knows which rows it
+    changed passes them in, sparing the scan for missing fitness.
+    """
+
+    def __init__(self, fitness_func, pool=None, cache=None):
+        self.fitness_func = fitness_func
+        self.pool = pool
+        self.cache = cache
+
+    def __call__(self, population, rows=None):
+        """
+        :param population: PackedPopulation to evaluate
+        :param rows: Distinct rows known to need fitness, found by
+        scanning the fitness vector if not given
+        :return: Whether anything was evaluated
+        """
+        if rows is None:
+            rows = np.flatnonzero(np.isnan(population.fitness))
+        if not len(rows):
+            return False
+        if len(rows) == population.population_size:
+            rows = None
+        population.apply_fitness(self.fitness_func, self.pool,
+                                 self.cache, rows=rows)
+        return True
+
+
+class Select:
+    """
+    Selection stage: one draw of parent indices for the generation.
+    """
+
+    def __init__(self, selection="roulette", **kwargs):
+        self.selection = get_selection(selection, **kwargs)
+        if self.selection is None:
+            raise ValueError(f"Unknown selection method {selection}")
+
+    def __call__(self, population, num):
+        # Reuse the selection while the population keeps it up to date
+        if population.selection is not self.selection:
+            population.prepare_selection(self.selection)
+        return self.selection.draw(num)
+
+
+class SparseMutation:
+    """
+    Mutation stage: independent per-locus flips with probability
+    p_mutate, applied in place.
+    """
+
+    def __init__(self, p_mutate):
+        self.p_mutate = p_mutate
+
+    def __call__(self, genes):
+        sparse_mutation(genes, self.p_mutate)
+        return None
+
+
+class Replacement(abc.ABC):
+    """
+    Base class for replacement stages.  offspring() says how many
+    children a step breeds, and calling the stage puts them into the
+    population, has them evaluated and returns the rows it changed.
+    """
+    name = None
+
+    def offspring(self, population):
+        return population.population_size
+
+    def reset(self):
+        """
+        Forget anything kept between steps, for a population changed
+        outside the stage.
+        """
+        return None
+
+    @abc.abstractmethod
+    def __call__(self, population, children, evaluate):
+        """
+        :param population: PackedPopulation being evolved
+        :param children: Gene matrix of offspring() children
+        :param evaluate: Evaluation stage, called with the population
+        and the changed rows
+        :return: Changed row indices, or None if every row changed
+        """
+
+
+class GenerationalReplacement(Replacement):
+    """
+    Replacement stage: the children replace the whole population.
+    """
+    name = "generational"
+
+    def __call__(self, population, children, evaluate):
+        population.replace(children)
+        evaluate(population)
+        return None
+
+
+class ElitistReplacement(Replacement):
+    """
+    Replacement stage: the elites fittest individuals survive and
+    children take every other place.  Survivors keep their fitness,
+    so only the children are evaluated.
+    """
+    name = "elitist"
+
+    def __init__(self, elites=1):
+        self.elites = elites
+
+    def offspring(self, population):
+        return max(population.population_size - self.elites, 0)
+
+    def __call__(self, population, children, evaluate):
+        fitness = population.fitness
+        num = len(children)
+        if not num:
+            return None
+        # The num least fit come first; everyone after them survives
+        rows = np.argpartition(fitness, num - 1)[:num] \
+            if num < len(fitness) else np.arange(num)
+        population.update(rows, children)
+        evaluate(population, rows)
+        return rows
+
+
+class SteadyStateReplacement(Replacement):
+    """
+    Replacement stage breeding only num_offspring children per step.
+    They replace the least fit individuals (replace "worst") or the
+    losers of tournaments of tournament_size ("tournament").  The gene
+    matrix and fitness vector are updated in place, only the children
+    are evaluated and observed, the prepared selection is patched
+    rather than rebuilt, and the least fit are kept in a heap, so a
+    step costs O(num_offspring log n) on top of breeding the children.
+    A generation of the experiment is then one such step.
+    """
+    name = "steady_state"
+
+    def __init__(self, num_offspring=2, replace="worst",
+                 tournament_size=2):
+        if replace not in ("worst", "tournament"):
+            raise ValueError(f"Unknown steady state replacement {replace}")
+        self.num_offspring = num_offspring
+        self.replace = replace
+        self.tournament_size = tournament_size
+        # (fitness, row) of every individual, for replace "worst"
+        self._heap = None
+        self._fitness = None
+
+    def __getstate__(self):
+        # The heap is rebuilt from whichever population it meets next
+        state = self.__dict__.copy()
+        state["_heap"] = state["_fitness"] = None
+        return state
+
+    def offspring(self, population):
+        return min(self.num_offspring, population.population_size)
+
+    def reset(self):
+        self._heap = self._fitness = None
+        return None
+
+    def _worst(self, fitness, num):
+        if self._fitness is not fitness:
+            # A sorted list is already a heap
+            order = np.lexsort((np.arange(len(fitness)), fitness))
+            self._heap = list(zip(fitness[order].tolist(),
+                                  order.tolist()))
+            self._fitness = fitness
+        return np.array([heapq.heappop(self._heap)[1]
+                         for _ in range(num)], dtype=np.int64)
+
+    def victims(self, population, num):
+        """
+        Distinct rows for num children.  Tournaments sharing a loser
+        give fewer rows than num.
+        """
+        fitness = population.fitness
+        if num >= len(fitness):
+            self.reset()
+            return np.arange(len(fitness))
+        if self.replace == "worst":
+            return self._worst(fitness, num)
+        entrants = np.random.randint(0, len(fitness),
+                                     (num, self.tournament_size))
+        losers = entrants[np.arange(num),
+                          fitness[entrants].argmin(axis=1)]
+        return np.unique(losers)
+
+    def __call__(self, population, children, evaluate):
+        rows = self.victims(population, len(children))
+        population.update(rows, children[:len(rows)])
+        evaluate(population, rows)
+        if self._fitness is population.fitness:
+            for row, value in zip(rows.tolist(),
+                                  population.fitness[rows].tolist()):
+                heapq.heappush(self._heap, (value, row))
+        return rows
+
+
+REPLACEMENT_METHODS = {
+    method.name: method for method in (
+        GenerationalReplacement,
+        ElitistReplacement,
+        SteadyStateReplacement,
+    )
+}
+
+
+def get_replacement(method="generational", **kwargs):
+    """
+    Build a replacement stage by name.
+    :param method: Key of REPLACEMENT_METHODS, or a Replacement
+    instance which is returned unchanged
+    :param kwargs: Parameters for the stage, e.g. elites or
+    num_offspring
+    :return: Replacement object, or None for unknown methods
+    """
+    if isinstance(method, Replacement):
+        return method
+    if method not in REPLACEMENT_METHODS:
+        log.error(f"Method {method} not implemented")
+        return None
+    return REPLACEMENT_METHODS[method](**kwargs)
+
+
+# ---------------------------------------------------------------------
+# Observers see every finished generation.  rows, when not None, are
+# the only individuals changed since the previous generation.
+# ---------------------------------------------------------------------
+
+class HallOfFameObserver:
+
+    def __init__(self, hall_of_fame):
+        self.hall_of_fame = hall_of_fame
+
+    def observe(self, population, generation, rows=None):
+        if rows is None:
+            self.hall_of_fame.add_many(population.fitness,
+                                       population.detach)
+            return None
+        self.hall_of_fame.add_many(population.fitness[rows],
+                                   lambda idx: population.detach(rows[idx]))
+        return None
+
+
+class StatsObserver:
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def observe(self, population, generation, rows=None):
+        self.stats.observe(generation, population.genes,
+                           population.fitness)
+        return None
+
+
+class CheckpointObserver:
+
+    def __init__(self, experiment):
+        self.experiment = experiment
+
+    def observe(self, population, generation, rows=None):
+        self.experiment.checkpoint(generation)
+        return None
+
+
+class FrameObserver:
+    """
+    Renders every generation into a preallocated, downsampled frame
+    and publishes it to a FrameBuffer for a display running elsewhere.
+    """
+
+    def __init__(self, frames, renderer=None):
+        self.frames = frames
+        self.renderer = renderer or FrameRenderer()
+
+    def observe(self, population, generation, rows=None):
+        self.frames.publish(generation,
+                            self.renderer.frame(population.genes))
+        return None
+
+
+class GenerationPipeline:
+    """
+    One generation of evolution as a sequence of stages:
+    evaluate -> select -> crossover -> mutate -> replace -> observe.
+    Each stage is a swappable operator working on the whole gene
+    matrix of a PackedPopulation, and observers (hall of fame,
+    statistics, drawing, checkpoints, ...) see every finished
+    generation.  With a StageProfiler, every stage and observer is
+    timed; without one, no timers run at all.
+    """
+
+    def __init__(self,
+                 evaluate,
+                 select,
+                 crossover,
+                 mutate,
+                 replace=None,
+                 observers=(),
+                 profiler=None):
+        self.evaluate = evaluate
+        self.select = select
+        self.crossover = crossover
+        self.mutate = mutate
+        self.replace = replace or GenerationalReplacement()
+        self.observers = list(observers)
+        self.profiler = profiler
+        # Population known to be fully evaluated after the last step
+        self._evaluated = None
+
+    @classmethod
+    def build(cls,
+              p_cross,
+              p_mutate,
+              fitness_func,
+              pool=None,
+              cache=None,
+              selection="roulette",
+              hall_of_fame=None,
+              observers=(),
+              crossover="single",
+              replacement="generational"):
+        """
+        Pipeline with the default operators.
+        """
+        observers = list(observers)
+        if hall_of_fame is not None:
+            observers.insert(0, HallOfFameObserver(hall_of_fame))
+        crossover = get_crossover(crossover, p_cross)
+        if crossover is None:
+            raise ValueError("Unknown crossover method")
+        replace = get_replacement(replacement)
+        if replace is None:
+            raise ValueError("Unknown replacement method")
+        return cls(Evaluate(fitness_func, pool, cache),
+                   Select(selection),
+                   crossover,
+                   SparseMutation(p_mutate),
+                   replace=replace,
+                   observers=observers)
+
+    def _stage(self, name):
+        if self.profiler is None:
+            return NO_STAGE
+        return self.profiler.stage(name)
+
+    def _evaluate(self, population, rows=None):
+        with self._stage("evaluate"):
+            return self.evaluate(population, rows)
+
+    def notify(self, population, generation, rows=None):
+        """
+        Show a generation to the observers.
+        :param rows: Rows changed since the previous generation, or
+        None if any may have
+        """
+        if self.profiler is None:
+            for observer in self.observers:
+                observer.observe(population, generation, rows)
+            return None
+        for observer in self.observers:
+            with self.profiler.stage(
+                    f"observe.{type(observer).__name__}"):
+                observer.observe(population, generation, rows)
+        return None
+
+    def start(self, population, generation=0):
+        """
+        Evaluate a fresh population and show it to the observers.
+        Does nothing for a population that already has fitness.  Call
+        it again after changing the population outside the pipeline.
+        """
+        if self._evaluate(population):
+            self.notify(population, generation)
+        self.replace.reset()
+        self._evaluated = population
+        return None
+
+    def breed(self, population, parents, num=None):
+        """
+        Children of the selected parents, crossed over and mutated.
+        A SharedPopulation evaluated on a pool is bred by the workers
+        straight into its idle gene buffer.
+        :param population: PackedPopulation being evolved
+        :param parents: Parent indices, mothers at even positions
+        :param num: Number of children, population_size by default
+        :return: Gene matrix of num children
+        """
+        if num is None:
+            num = population.population_size
+        pool = self.evaluate.pool
+        if pool is not None and isinstance(population, SharedPopulation) \
+                and num == population.population_size:
+            with self._stage("breed_shared"):
+                pool.breed_shared(population, parents, self.crossover,
+                                  self.mutate)
+            return population.next_genes
+        genes = population.genes
+        with self._stage("crossover"):
+            child1, child2 = self.crossover(genes[parents[0::2]],
+                                            genes[parents[1::2]],
+                                            population.layout)
+            children = np.empty((len(parents), population.num_loci),
+                                dtype=np.uint8)
+            children[0::2] = child1
+            children[1::2] = child2
+        with self._stage("mutate"):
+            self.mutate(children)
+        # Drop the extra child of the last pair for odd sizes
+        return children[:num]
+
+    def step(self, population, generation=0):
+        """
+        Evolve the population by one generation, in place.
+        :param population: PackedPopulation to evolve
+        :param generation: Number of the generation being produced
+        :return: None
+        """
+        if self.profiler is not None:
+            self.profiler.begin_generation(generation)
+        if population is not self._evaluated:
+            self.start(population, generation - 1)
+        num = self.replace.offspring(population)
+        rows = np.zeros(0, dtype=np.int64)
+        # Nothing to breed, e.g. when every individual is an elite
+        if num:
+            num_pairs = (num + 1) // 2
+            with self._stage("select"):
+                parents = self.select(population, 2 * num_pairs)
+            children = self.breed(population, parents, num)
+            with self._stage("replace"):
+                rows = self.replace(population, children, self._evaluate)
+        self.notify(population, generation, rows)
+        if self.profiler is not None:
+            self.profiler.end_generation()
+        return None
+
+
 class Experiment:
+    """
+    Base experiment configuration, run through a GenerationPipeline
+    built from the named selection, crossover and replacement methods
+    and their *_options.  Object Populations are packed for the run
+    and unpacked at the end.  n_workers evaluates fitness on a process
+    pool that lives for the whole experiment, cache_size keeps an LRU
+    cache of genome fitness values, and checkpoint_path with
+    checkpoint_every saves checkpoints that resume() restarts from
+    bit-exactly.  stats, recorder, profiler and any extra observers
+    see every generation; stop() ends a run after the current one.
+    """
 
     def __init__(self,
                  population,
                  generations,
                  p_cross,
                  p_mutate,
-                 fitness_func):
+                 fitness_func,
+                 n_workers=None,
+                 cache_size=None,
+                 selection="roulette",
+                 selection_options=None,
+                 crossover="single",
+                 crossover_options=None,
+                 replacement="generational",
+                 replacement_options=None,
+                 checkpoint_path=None,
+                 checkpoint_every=None,
+                 stats=None,
+                 recorder=None,
+                 profiler=None,
+                 observers=()):
         self._population = population
         self._generations = generations
         self._p_cross = p_cross
         self._p_mutate = p_mutate
         self._fitness_func = fitness_func
+        self._n_workers = n_workers
+        self._pool = None
+        self._cache = FitnessCache(cache_size) if cache_size else None
+        self._selection = get_selection(selection,
+                                        **(selection_options or {}))
+        if self._selection is None:
+            raise ValueError(f"Unknown selection method {selection}")
+        # Diploids breed by meiosis, recombining with the named operator
+        build_crossover = get_meiosis \
+            if isinstance(population, DiploidPopulation) else get_crossover
+        self._crossover = build_crossover(crossover, p_cross,
+                                          **(crossover_options or {}))
+        if self._crossover is None:
+            raise ValueError(f"Unknown crossover method {crossover}")
+        self._replacement = get_replacement(
+            replacement, **(replacement_options or {}))
+        if self._replacement is None:
+            raise ValueError(f"Unknown replacement method {replacement}")
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint_every = checkpoint_every
+        self._generation = 0
+        self._stats = stats
+        self._recorder = recorder
+        self._profiler = profiler
+        self._observers = list(observers)
+        self._stopping = threading.Event()
+
+    @classmethod
+    def resume(cls, path, fitness_func, **kwargs):
+        """
+        Rebuild an experiment from a checkpoint, including the RNG
+        states, so run() continues exactly where the checkpointed run
+        left off.
+        :param path: Checkpoint directory written by a previous run
+        :param fitness_func: Fitness function (not stored in
+        checkpoints)
+        :param kwargs: Settings overriding the checkpointed ones, and
+        any the subclass needs (e.g. ax for VisualSimpleExperiment)
+        :return: Experiment of the calling class
+        """
+        state = load_checkpoint(path)
+        config = dict(state["config"])
+        config.update(kwargs)
+        experiment = cls(population=state["population"],
+                         fitness_func=fitness_func,
+                         **config)
+        experiment._generation = state["generation"]
+        return experiment
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     @property
     def population(self):
@@ -45,6 +586,156 @@ class Experiment:
     def p_mutate(self):
         return self._p_mutate
 
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @property
+    def crossover(self):
+        return self._crossover
+
+    @property
+    def replacement(self):
+        return self._replacement
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def selection(self):
+        return self._selection
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def pool(self):
+        """
+        Fitness process pool, created on first use and reused until
+        close() is called.  None when running serially.
+        """
+        if self._pool is None and self._n_workers:
+            self._pool = FitnessPool(self._n_workers)
+        return self._pool
+
+    def config(self):
+        """
+        Settings stored with checkpoints.
+        """
+        return {
+            "generations": self._generations,
+            "p_cross": self._p_cross,
+            "p_mutate": self._p_mutate,
+            "selection": self._selection,
+            "crossover": self._crossover,
+            "replacement": self._replacement,
+            "checkpoint_path": self._checkpoint_path,
+            "checkpoint_every": self._checkpoint_every,
+        }
+
+    def observers(self):
+        """
+        Observers for the run, in the order they see a generation.
+        """
+        observers = []
+        if self._population.hall_of_fame is not None:
+            observers.append(
+                HallOfFameObserver(self._population.hall_of_fame))
+        if self._stats is not None:
+            observers.append(StatsObserver(self._stats))
+        if self._recorder is not None:
+            observers.append(self._recorder)
+        if self._checkpoint_path and self._checkpoint_every:
+            observers.append(CheckpointObserver(self))
+        return observers + self._observers
+
+    def pipeline(self):
+        return GenerationPipeline(
+            Evaluate(self._fitness_func, self.pool, self._cache),
+            Select(self._selection),
+            self._crossover,
+            SparseMutation(self._p_mutate),
+            replace=self._replacement,
+            observers=self.observers(),
+            profiler=self._profiler
+        )
+
+    def run(self):
+        """
+        Evolve the population for the remaining generations.
+        :return: The evolved population, of the type passed in
+        """
+        # Imported here so headless workers never load progress bars
+        from tqdm import tqdm
+
+        unpack = not isinstance(self._population, PackedPopulation)
+        if unpack:
+            self._population = PackedPopulation.from_population(
+                self._population)
+        pipeline = self.pipeline()
+        pipeline.start(self._population, self._generation)
+        for _ in tqdm(range(self._generation, self.generations)):
+            if self._stopping.is_set():
+                break
+            pipeline.step(self._population, self._generation + 1)
+            self._generation += 1
+        # Cleared here rather than on entry, so a stop() that lands
+        # before a run gets going is not lost
+        self._stopping.clear()
+        if self._profiler is not None and LOG_FLAGS.info:
+            log.info(f"Stage timings:\n{self._profiler.report()}")
+        if unpack:
+            self._population = self._unpack(self._population)
+        return self._population
+
+    @staticmethod
+    def _unpack(population):
+        """
+        Object Population for a packed one, with the hall of fame
+        holding Individuals again rather than views.
+        """
+        if population.hall_of_fame is not None:
+            population.hall_of_fame.convert(
+                lambda person: person.to_individual()
+                if isinstance(person, IndividualView) else person)
+        return population.to_population()
+
+    def checkpoint(self, generation):
+        """
+        Save a checkpoint if one is due at the given generation.
+        :return: None
+        """
+        if not self._checkpoint_path or not self._checkpoint_every:
+            return None
+        if generation % self._checkpoint_every \
+                and generation != self._generations:
+            return None
+        save_checkpoint(self._checkpoint_path, self.population,
+                        generation, self.config())
+        return None
+
+    def stop(self):
+        self._stopping.set()
+        return None
+
+    def close(self):
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        return None
+
 
 class SimpleExperiment(Experiment):
 
@@ -56,121 +747,95 @@ class SimpleExperiment(Experiment):
     def pop_size(self):
         return self._pop_size
 
-    def run(self):
-        new_pop = Population(
-            [],
-            hall_of_fame=self.population.hall_of_fame
-        )
-        for _ in tqdm(range(self.generations)):
-            replaced = 0
-            new_pop = Population(
-                [],
-                hall_of_fame=new_pop.hall_of_fame
-            )
-            # Assign fitness function to population
-            self.population.apply_fitness(self.fitness_func)
-            # Track fittest people
-            if self.population.hall_of_fame is not None:
-                for person in self.population.individuals:
-                    self.population.hall_of_fame.add(person)
-            while replaced < self._pop_size:
-                # Sample the population for mating
-                mother, father = self.population.sample_population(2)
-                if random.random() < self.p_cross:
-                    # Perform crossover to produce offspring
-                    n_codons = mother.chromosomes[0].num_codons
-                    length_codons = mother.chromosomes[0].codon_lengths
-                    crossovers = choice(
-                        list(range(1, length_codons + 1)),
-                        n_codons
-                    )
-                    child1, child2 = mother.fuse(father, crossovers)
-                else:
-                    child1 = copy.deepcopy(mother)
-                    child2 = copy.deepcopy(father)
-                # Perform mutations on each child
-                child1.random_mutation(self.p_mutate)
-                child2.random_mutation(self.p_mutate)
-                # Get fitness of the children
-                child1.apply(self.fitness_func)
-                child2.apply(self.fitness_func)
-                # Update the hall of fame if needed
-                if self.population.hall_of_fame:
-                    self.population.hall_of_fame.add(child1)
-                    self.population.hall_of_fame.add(child2)
-                # Remove parents, add children, and update counts
-                new_pop.add({child1, child2})
-                replaced += 2
-            if self._pop_size % 2 == 1:
-                new_pop.remove(child1)
-        final_pop = new_pop
-        return final_pop
-
 
 class VisualSimpleExperiment(Experiment):
+    """
+    Experiment that shows the population as it evolves.  Every
+    generation is published to a bounded FrameBuffer, and the display
+    pulls the newest frame every time_interval seconds, dropping stale
+    ones, so drawing never slows evolution down.  start() runs the
+    evolution on a background thread and animate() drives the display
+    from a Tk window's timer, keeping the GUI responsive.  Populations
+    of more than max_rows individuals are binned down to max_rows
+    image rows; render_mode "alleles" shows per-locus allele
+    frequencies instead.
+    """
 
-    def __init__(self, ax, canvas, time_interval, **kwargs):
+    def __init__(self, ax, canvas, time_interval, frame_buffer_size=4,
+                 max_rows=512, render_mode="bin", **kwargs):
         super().__init__(**kwargs)
         self._pop_size = self.population.population_size
         self.canvas = canvas
         self.ax = ax
         self.time_interval = time_interval
+        self._frames = FrameBuffer(frame_buffer_size)
+        # Room for every buffered frame plus the one on display
+        self._renderer = FrameRenderer(max_rows, render_mode,
+                                       slots=frame_buffer_size + 2)
+        self._player = None
+        self._thread = None
+        self._result = None
 
     @property
     def pop_size(self):
         return self._pop_size
 
+    @property
+    def frames(self):
+        return self._frames
+
+    @property
+    def result(self):
+        """
+        Population returned by the last finished run.
+        """
+        return self._result
+
+    def observers(self):
+        return super().observers() + [
+            FrameObserver(self._frames, self._renderer)
+        ]
+
     def run(self):
-        new_pop = Population(
-            [],
-            hall_of_fame=self.population.hall_of_fame
-        )
-        for _ in tqdm(range(self.generations)):
-            replaced = 0
-            new_pop = Population(
-                [],
-                hall_of_fame=new_pop.hall_of_fame
-            )
-            # Assign fitness function to population
-            self.population.apply_fitness(self.fitness_func)
-            # Track fittest people
-            if self.population.hall_of_fame is not None:
-                for person in self.population.individuals:
-                    self.population.hall_of_fame.add(person)
-            while replaced < self._pop_size:
-                # Sample the population for mating
-                mother, father = self.population.sample_population(2)
-                if random.random() < self.p_cross:
-                    # Perform crossover to produce offspring
-                    n_codons = mother.chromosomes[0].num_codons
-                    length_codons = mother.chromosomes[0].codon_lengths
-                    crossovers = choice(
-                        list(range(1, length_codons + 1)),
-                        n_codons
-                    )
-                    child1, child2 = mother.fuse(father, crossovers)
-                else:
-                    child1 = copy.deepcopy(mother)
-                    child2 = copy.deepcopy(father)
-                # Perform mutations on each child
-                child1.random_mutation(self.p_mutate)
-                child2.random_mutation(self.p_mutate)
-                # Get fitness of the children
-                child1.apply(self.fitness_func)
-                child2.apply(self.fitness_func)
-                # Update the hall of fame if needed
-                if self.population.hall_of_fame:
-                    self.population.hall_of_fame.add(child1)
-                    self.population.hall_of_fame.add(child2)
-                # Remove parents, add children, and update counts
-                new_pop.add({child1, child2})
-                replaced += 2
-            if self._pop_size % 2 == 1:
-                new_pop.remove(child1)
-            new_pop.draw(self.ax, self.canvas)
-            time.sleep(self.time_interval)
-        final_pop = new_pop
-        return final_pop
+        try:
+            self._result = super().run()
+        finally:
+            self._frames.close()
+        return self._result
+
+    def start(self):
+        """
+        Run the experiment on a background thread.
+        :return: The thread
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self._result
+
+    def render(self):
+        """
+        Draw the newest published frame on ax.
+        :return: Generation drawn, or None if no new frame
+        """
+        if self._player is None:
+            self._player = FramePlayer(None, self.ax, self.canvas,
+                                       self._frames, self.time_interval)
+        return self._player.render()
+
+    def animate(self, window):
+        """
+        Show frames on window's event loop until the run finishes.
+        """
+        self._player = FramePlayer(window, self.ax, self.canvas,
+                                   self._frames, self.time_interval)
+        self._player.start()
+        return None
 
 
 def number_ones(chromosome):
@@ -201,7 +866,7 @@ def main():
     ax = fig.add_subplot(111)  # create axis
     ax.axis('off')
 
-    final_pop = VisualSimpleExperiment(
+    experiment = VisualSimpleExperiment(
         ax,
         None,
         .1,
@@ -210,7 +875,14 @@ def main():
         p_cross=.9,
         p_mutate=.001,
         fitness_func=fit
-    ).run()
+    )
+    experiment.start()
+    while not experiment.frames.finished:
+        experiment.render()
+        plt.pause(experiment.time_interval)
+    final_pop = experiment.join()
+    print(f"Showed {experiment.frames.shown} of "
+          f"{experiment.frames.published} frames")
 
     print("------ FINAL POPULATION ---------")
     final_pop.apply_fitness(fit)
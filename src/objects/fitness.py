@@ -0,0 +1,235 @@
+from collections import OrderedDict
+import numpy as np
+from common_imports import *
+
+log = get_logger(__name__)
+
+
+def batch_fitness(func=None, chunk_size=None):
+    """
+    Mark a fitness function as batch capable.  Instead of a list of
+    chromosomes, a batch function receives a 2-D uint8 gene matrix
+    (one row per individual) and returns a vector with one fitness
+    value per row.  Can be used bare (@batch_fitness) or with
+    arguments (@batch_fitness(chunk_size=10000)).
+
+    :param func: Function taking a gene matrix
+    :param chunk_size: Optional maximum number of rows per call
+    :return: The same function, tagged as batch capable
+    """
+    def wrap(f):
+        f.batch = True
+        f.chunk_size = chunk_size
+        return f
+
+    if func is None:
+        return wrap
+    return wrap(func)
+
+
+def is_batch(func):
+    return getattr(func, "batch", False)
+
+
+def stochastic_fitness(func):
+    """
+    Mark a fitness function as stochastic, i.e. the same genome can
+    score differently on different calls.  Such functions are never
+    served from a FitnessCache.
+    """
+    func.stochastic = True
+    return func
+
+
+def is_cacheable(func):
+    return not getattr(func, "stochastic", False)
+
+
+def evaluate_batch(func, genes):
+    """
+    Evaluate a batch fitness function over a gene matrix, chunking the
+    rows if the function asks for it.
+    :param func: Batch fitness function
+    :param genes: 2-D gene matrix
+    :return: float64 vector of fitness values, one per row
+    """
+    chunk_size = getattr(func, "chunk_size", None) or len(genes)
+    ans = np.empty(len(genes), dtype=np.float64)
+    for start in range(0, len(genes), max(chunk_size, 1)):
+        stop = start + chunk_size
+        values = np.asarray(func(genes[start:stop]), dtype=np.float64)
+        if values.shape != (len(genes[start:stop]),):
+            raise ValueError("Batch fitness must return one value per "
+                             "individual")
+        ans[start:stop] = values
+    return ans
+
+
+class FitnessCache:
+    """
+    Size-bounded LRU cache of fitness values keyed by the bit-packed
+    genome.  A cache belongs to one fitness function; handing it a
+    different function clears it.
+    """
+
+    def __init__(self, maxsize=100000):
+        self._maxsize = maxsize
+        self._store = OrderedDict()
+        self._func = None
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"FitnessCache(size={len(self)}, " \
+               f"maxsize={self._maxsize}, hits={self.hits}, " \
+               f"misses={self.misses})"
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    @staticmethod
+    def key(genes):
+        """
+        Cache key for a single genome.
+        :param genes: 1-D gene vector
+        :return: bytes key
+        """
+        return np.packbits(genes).tobytes()
+
+    @staticmethod
+    def keys(genes):
+        """
+        Cache keys for each row of a gene matrix.
+        :param genes: 2-D gene matrix
+        :return: List of bytes keys
+        """
+        packed = np.packbits(genes, axis=1)
+        return [row.tobytes() for row in packed]
+
+    def bind(self, func):
+        if func is not self._func:
+            self.clear()
+            self._func = func
+        return None
+
+    def get(self, key):
+        num = self._store.get(key)
+        if num is None:
+            self.misses += 1
+            return None
+        self._store.move_to_end(key)
+        self.hits += 1
+        return num
+
+    def put(self, key, num):
+        self._store[key] = num
+        self._store.move_to_end(key)
+        if len(self._store) > self._maxsize:
+            self._store.popitem(last=False)
+        return None
+
+    def clear(self):
+        self._store.clear()
+        self.hits = 0
+        self.misses = 0
+        return None
+
+    def evaluate(self, func, genes, evaluate):
+        """
+        Fitness of every row of a gene matrix, computing only genomes
+        not already cached.  Duplicate genomes within the matrix are
+        evaluated once.
+        :param func: Fitness function the values belong to
+        :param genes: 2-D gene matrix
+        :param evaluate: Callable taking an array of row indices and
+        returning their fitness values
+        :return: float64 fitness vector
+        """
+        self.bind(func)
+        keys = self.keys(genes)
+        ans = np.empty(len(keys), dtype=np.float64)
+        pending = {}
+        for idx, key in enumerate(keys):
+            num = self.get(key)
+            if num is None:
+                pending.setdefault(key, []).append(idx)
+            else:
+                ans[idx] = num
+        if pending:
+            first = np.array([rows[0] for rows in pending.values()])
+            values = np.asarray(evaluate(first), dtype=np.float64)
+            for (key, rows), num in zip(pending.items(), values):
+                ans[rows] = num
+                self.put(key, num.item())
+        return ans
+
+
+@batch_fitness
+def number_ones(genes):
+    """
+    OneMax: the number of set loci in each genome.
+    """
+    return np.count_nonzero(genes, axis=1)
+
+
+@batch_fitness
+def leading_ones(genes):
+    """
+    Number of consecutive set loci at the start of each genome.
+    """
+    return np.cumprod(genes, axis=1, dtype=np.uint8).sum(axis=1)
+
+
+def trap(k=4):
+    """
+    Concatenated deceptive trap of order k.  Each block of k loci
+    scores k when all are set and k - 1 - u otherwise, where u is the
+    number of set loci, so hill climbing is led away from the optimum.
+    :param k: Block length, must divide the genome length
+    :return: Batch fitness function
+    """
+    @batch_fitness
+    def trap_k(genes):
+        ones = genes.reshape(len(genes), -1, k).sum(axis=2)
+        return np.where(ones == k, k, k - 1 - ones).sum(axis=1)
+
+    trap_k.__name__ = f"trap_{k}"
+    return trap_k
+
+
+def royal_road(block=8):
+    """
+    Royal road function R1 from Mitchell's book: each block of
+    complete set loci contributes the block length.
+    :param block: Block length, must divide the genome length
+    :return: Batch fitness function
+    """
+    @batch_fitness
+    def royal_road_block(genes):
+        blocks = genes.reshape(len(genes), -1, block).all(axis=2)
+        return block * blocks.sum(axis=1)
+
+    royal_road_block.__name__ = f"royal_road_{block}"
+    return royal_road_block
+
+
+def main():
+    genes = np.random.randint(0, 2, (5, 16), dtype=np.uint8)
+    print(genes)
+    print("OneMax: ", evaluate_batch(number_ones, genes))
+    print("Leading ones: ", evaluate_batch(leading_ones, genes))
+    print("Trap 4: ", evaluate_batch(trap(4), genes))
+    print("Royal road 4: ", evaluate_batch(royal_road(4), genes))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 from src.objects.chromosome import Chromosome, Codon
+from src.objects.fitness import is_batch, is_cacheable, evaluate_batch
+from src.objects.selection import get_selection
+from src.objects.mutation import mutation_positions
+from src.objects.rendering import downsample, show_frame
 from typing import List, Iterable
-import matplotlib.pyplot as plt
 import numpy as np
 from numpy.random import choice
-import random
-import copy
+import heapq
+import itertools
 from common_imports import *
 
 log = get_logger(__name__)
@@ -45,11 +48,37 @@ class Individual:
         self._fitness = num
         return None
 
-    def apply(self, func):
-        num = func(self.chromosomes)
+    def apply(self, func, cache=None):
+        """
+        Evaluate and store the fitness of the individual.
+        :param func: Fitness function taking a list of chromosomes
+        :param cache: Optional FitnessCache consulted before calling
+        func
+        :return: None
+        """
+        if cache is None or not is_cacheable(func):
+            self.update_fitness(func(self.chromosomes))
+            return None
+        cache.bind(func)
+        key = cache.key(self.to_array())
+        num = cache.get(key)
+        if num is None:
+            num = func(self.chromosomes)
+            cache.put(key, num)
         self.update_fitness(num)
         return None
 
+    def clone(self):
+        """
+        Fast copy of the individual.  Chromosomes are cloned
+        copy-on-write, so an unmutated clone costs a few small objects
+        and no genetic material is copied.
+        :return: Individual with the same genes and fitness
+        """
+        person = Individual([chrom.clone() for chrom in self._chromosomes])
+        person.update_fitness(self._fitness)
+        return person
+
     def fuse(self, individual, crossovers):
         """
         Mating of two individuals.  Crossover points for each codon
@@ -75,21 +104,36 @@ class Individual:
         return
 
     def random_mutation(self, p_mutate):
-        mutation_dict = {}
-        n_codons = self.chromosomes[0].num_codons
-        length_codons = self.chromosomes[0].codon_lengths
-        for idx in range(n_codons):
-            mutation_dict[idx] = []
-            for item in range(length_codons):
-                if random.random() < p_mutate:
-                    mutation_dict[idx].append(item)
-        self.mutate(mutation_dict)
+        """
+        Flip each bit independently with probability p_mutate.  Only
+        the positions that mutate are drawn (see mutation_positions),
+        so the cost scales with the number of flips.  Every chromosome
+        draws its own positions, so the homologs of a diploid do not
+        share mutations.
+        :param p_mutate: Per-bit mutation probability
+        :return: None
+        """
+        for chrom in self._chromosomes:
+            length_codons = chrom.codon_lengths
+            positions = mutation_positions(
+                chrom.num_codons * length_codons, p_mutate)
+            if not len(positions):
+                continue
+            mutation_dict = {}
+            for position in positions.tolist():
+                idx, item = divmod(position, length_codons)
+                mutation_dict.setdefault(idx, []).append(item)
+            chrom.mutate(mutation_dict)
         return None
 
     def to_list(self):
         chromes = [item.to_list()[0] for item in self._chromosomes]
         return "".join(chromes)
 
+    def to_array(self):
+        return np.frombuffer(self.to_list().encode(), dtype=np.uint8) \
+            - ord("0")
+
 class Population:
 
     def __init__(self,
@@ -99,6 +143,7 @@ class Population:
         self._individuals = list(individuals)
         self._population_size = len(self._individuals)
         self._hall_of_fame = hall_of_fame
+        self._selection = None
 
     @property
     def individuals(self):
@@ -112,15 +157,34 @@ class Population:
     def hall_of_fame(self):
         return self._hall_of_fame
 
-    def to_array(self):
-        ans = []
-        for person in self._individuals:
-            person_list = [int(item) for item in person.to_list()]
-            ans.append(person_list)
-        return np.array(ans)
+    def layout(self):
+        """
+        Genome layout shared by the population, taken from the first
+        individual.
+        :return: (num_chromosomes, num_codons, codon_length)
+        """
+        first = self._individuals[0].chromosomes
+        return len(first), first[0].num_codons, first[0].codon_lengths
 
-    def draw(self, ax, canvas):
-        ax.imshow(self.to_array())
+    def to_array(self, out=None):
+        """
+        Gene matrix of the population, one row per individual.
+        :param out: Optional preallocated uint8 array to fill
+        :return: uint8 array of 0/1 alleles
+        """
+        if not self._individuals:
+            return np.zeros((0, 0), dtype=np.uint8)
+        rows = "".join(person.to_list() for person in self._individuals)
+        genes = np.frombuffer(rows.encode(), dtype=np.uint8) \
+            .reshape(self._population_size, -1)
+        return np.subtract(genes, ord("0"), out=out)
+
+    def draw(self, ax, canvas, max_rows=512):
+        """
+        Show the population on ax, reusing the axis' image if it has
+        one of the same shape.  Populations above max_rows are binned.
+        """
+        show_frame(ax, downsample(self.to_array(), max_rows), canvas)
         return None
 
     def add(self, member):
@@ -129,6 +193,7 @@ class Population:
         for item in member:
             self._individuals += [item]
             self._population_size += 1
+        self._selection = None
         return None
 
     def remove(self, member):
@@ -137,11 +202,43 @@ class Population:
         for item in member:
             self._individuals.remove(item)
             self._population_size -= 1
+        self._selection = None
         return None
 
-    def apply_fitness(self, func):
-        for member in self._individuals:
-            member.apply(func)
+    def apply_fitness(self, func, pool=None, cache=None):
+        """
+        Evaluate fitness for every member of the population.
+        :param func: Fitness function, per individual or batch
+        :param pool: Optional FitnessPool to evaluate in parallel
+        :param cache: Optional FitnessCache; only genomes it has not
+        seen are evaluated
+        :return: None
+        """
+        self._selection = None
+        if not self._individuals:
+            return None
+        if pool is None and cache is None and not is_batch(func):
+            for member in self._individuals:
+                member.apply(func)
+            return None
+        genes = self.to_array()
+
+        def evaluate(rows):
+            if pool is not None:
+                return pool.evaluate(func, genes[rows], self.layout())
+            if is_batch(func):
+                return evaluate_batch(func, genes[rows])
+            for idx in rows:
+                self._individuals[idx].apply(func)
+            return [self._individuals[idx].fitness for idx in rows]
+
+        if cache is not None and is_cacheable(func):
+            values = cache.evaluate(func, genes, evaluate)
+        else:
+            values = np.asarray(evaluate(np.arange(len(genes))),
+                                dtype=np.float64)
+        for member, num in zip(self._individuals, values):
+            member.update_fitness(num.item())
         return None
 
     def average_fitness(self):
@@ -150,84 +247,80 @@ class Population:
             ans += person.fitness
         return ans / self._population_size
 
+    def prepare_selection(self, method="roulette", **kwargs):
+        """
+        Build a selection strategy over the current fitness values.
+        The prepared strategy is reused by sample_population until
+        fitness is re-applied or the membership changes.
+        :param method: Name from SELECTION_METHODS or a Selection
+        :param kwargs: Parameters for the strategy
+        :return: Prepared Selection object, None for unknown methods
+        """
+        selection = get_selection(method, **kwargs)
+        if selection is not None:
+            selection.prepare([item.fitness for item in self._individuals])
+        self._selection = selection
+        return selection
+
     def sample_population(self, num, method="roulette"):
         """
-        Implements roulette wheel sampling from the population where
-        probability of being selected is based on fraction of total
-        fitness an individual has.
+        Sample the population with the given selection method.  The
+        default roulette wheel makes the probability of being selected
+        an individual's fraction of the total fitness.
         :param num: Number of individuals to return
-        :param method: Type of sampling to use (roulette is default)
+        :param method: Type of sampling to use (roulette is default),
+        see SELECTION_METHODS, or a Selection object
         :return: Tuple of Individual objects drawn from the population
         """
-        if method == "roulette":
-            probs = list(map(lambda x: x.fitness, self.individuals))
-            prob_sum = sum(probs)
-            probs = [
-                item / prob_sum for item in probs
-            ]
-        else:
-            log.error(f"Method {method} not implemented")
+        selection = self._selection
+        if selection is None \
+                or (method is not selection and method != selection.name):
+            selection = self.prepare_selection(method)
+        if selection is None:
             return tuple(num * [None])
-        members = choice(self.individuals, num, p=probs)
-        return members
+        return tuple(self._individuals[idx]
+                     for idx in selection.draw(num))
 
     def evolve_one_step(self,
                         p_cross,
                         p_mutate,
-                        fitness_func
+                        fitness_func,
+                        pool=None,
+                        cache=None,
+                        selection="roulette",
+                        crossover="single",
+                        replacement="generational"
                         ):
-        replaced = 0
-        new_pop = Population(
-            [],
-        )
-        # Assign fitness function to population
-        self.apply_fitness(fitness_func)
-        # Track fittest people
-        if self.hall_of_fame is not None:
-            for person in self._individuals:
-                self.hall_of_fame.add(person)
-        while replaced < self._population_size:
-            # Sample the population for mating
-            mother, father = self.sample_population(2)
-            if random.random() < p_cross:
-                # Perform crossover to produce offspring
-                n_codons = mother.chromosomes[0].num_codons
-                length_codons = mother.chromosomes[0].codon_lengths
-                crossovers = choice(
-                    list(range(1, length_codons + 1)),
-                    n_codons
-                )
-                child1, child2 = mother.fuse(father, crossovers)
-            else:
-                child1 = copy.deepcopy(mother)
-                child2 = copy.deepcopy(father)
-            # Perform mutations on each child
-            child1.random_mutation(p_mutate)
-            child2.random_mutation(p_mutate)
-            # Get fitness of the children
-            child1.apply(fitness_func)
-            child2.apply(fitness_func)
-            # Update the hall of fame if needed
-            if self.hall_of_fame:
-                self.hall_of_fame.add(child1)
-                self.hall_of_fame.add(child2)
-            # Remove parents, add children, and update counts
-            new_pop.add({child1, child2})
-            replaced += 2
-        if self._population_size % 2 == 1:
-            new_pop.remove(child1)
-        self._individuals = new_pop.individuals
+        """
+        Evolve by one generation.  The population is packed into a
+        gene matrix, bred through the default GenerationPipeline and
+        unpacked into new individuals.
+        :return: None
+        """
+        from src.objects.packed import PackedPopulation
+
+        packed = PackedPopulation.from_population(self)
+        packed.evolve_one_step(p_cross, p_mutate, fitness_func, pool,
+                               cache, selection, crossover, replacement)
+        self._individuals = [person.to_individual()
+                             for person in packed.individuals]
+        self._selection = None
         return None
 
 class Fittest:
     """
-    Class to maintain the fittest members of a population
+    Class to maintain the fittest members of a population.  Members
+    sit in a bounded min-heap, so the weakest of the current top num
+    is always at the root: rejecting an individual is O(1) and
+    inserting one O(log num).  With dedupe set, a genome already in
+    the hall of fame is not stored a second time.
     """
-    def __init__(self, num):
+    def __init__(self, num, dedupe=False):
         self.num = num
-        self.queue = self.num * [Individual([Codon(0)])]
-        for item in self.queue:
-            item.update_fitness(0)
+        self._dedupe = dedupe
+        self._heap = []
+        self._keys = set()
+        self._counter = itertools.count()
 
     def __repr__(self):
         ans = "{" + f"\n -- Top {self.num} individuals -- \n"
@@ -236,21 +329,98 @@ class Fittest:
         ans += "}"
         return ans
 
+    @property
+    def queue(self):
+        """
+        Members ordered from fittest to least fit.
+        """
+        return [entry[-1] for entry in sorted(self._heap, reverse=True)]
+
+    @property
+    def size(self):
+        return len(self._heap)
+
+    @property
+    def dedupe(self):
+        return self._dedupe
+
+    @property
+    def min_fitness(self):
+        if len(self._heap) < self.num:
+            return None
+        return self._heap[0][0]
+
     def add(self, person: Individual):
-        flag = False
-        if person.fitness >= self.queue[-1].fitness:
-            for idx in range(self.num):
-                if self.queue[idx].fitness < person.fitness:
-                    last = self.queue[idx:-1]
-                    self.queue[idx] = person
-                    flag = True
-                    break
-            if flag:
-                self.queue = self.queue[: idx + 1] + last
+        fitness = person.fitness
+        if fitness is None:
             return None
-        else:
+        full = len(self._heap) >= self.num
+        if full and fitness <= self._heap[0][0]:
             return None
+        key = None
+        if self._dedupe:
+            key = np.packbits(person.to_array()).tobytes()
+            if key in self._keys:
+                return None
+            self._keys.add(key)
+        if isinstance(person, Individual):
+            # Later in-place mutation of the member must not reach the
+            # hall of fame; the clone is copy-on-write, so this is cheap
+            person = person.clone()
+        # The counter breaks fitness ties so people are never compared
+        entry = (fitness, next(self._counter), key, person)
+        if full:
+            removed = heapq.heapreplace(self._heap, entry)
+            self._keys.discard(removed[2])
+        else:
+            heapq.heappush(self._heap, entry)
+        return None
 
+    def convert(self, func):
+        """
+        Replace every member by func(member), keeping its place.
+        :param func: Callable mapping a member to its replacement
+        :return: None
+        """
+        self._heap = [entry[:-1] + (func(entry[-1]),)
+                      for entry in self._heap]
+        return None
+
+    def add_many(self, fitness, get_member):
+        """
+        Bulk insertion from a fitness vector.  Candidates are taken
+        fittest first, in growing batches, and the scan stops as soon
+        as the heap is full and the next candidate cannot beat its
+        weakest member, so only individuals that can enter the heap
+        are materialized, with or without dedupe.
+
+        :param fitness: Vector of fitness values
+        :param get_member: Callable mapping an index of fitness to the
+        individual to store
+        :return: None
+        """
+        fitness = np.asarray(fitness, dtype=np.float64)
+        remaining = np.flatnonzero(~np.isnan(fitness))
+        threshold = self.min_fitness
+        if threshold is not None:
+            remaining = remaining[fitness[remaining] > threshold]
+        # Duplicates can leave the heap short, hence further batches
+        batch = max(self.num, 1)
+        while len(remaining):
+            if len(remaining) > batch:
+                part = np.argpartition(-fitness[remaining], batch - 1)
+                chunk = remaining[part[:batch]]
+                remaining = remaining[part[batch:]]
+            else:
+                chunk, remaining = remaining, remaining[:0]
+            order = np.argsort(-fitness[chunk], kind="stable")
+            for idx in chunk[order]:
+                if len(self._heap) >= self.num \
+                        and fitness[idx] <= self._heap[0][0]:
+                    return None
+                self.add(get_member(idx))
+            batch *= 2
+        return None
 
 
 def main():
@@ -278,7 +448,14 @@ def main():
 
     print(pop.to_array())
 
-
+    # Clones share codons until one side mutates
+    person = pop.individuals[0]
+    twin = person.clone()
+    before = person.to_list()
+    shared = twin.chromosomes[0].codons is person.chromosomes[0].codons
+    twin.random_mutation(1.)
+    print("Copy-on-write clone:", shared,
+          person.to_list() == before, twin.to_list() != before)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+import multiprocessing as mp
+import random
+import traceback
+import numpy as np
+from src.objects.experiment import Experiment, GenerationPipeline, \
+    Evaluate, Select, SparseMutation, HallOfFameObserver
+from src.objects.individual import Fittest
+from src.objects.packed import PackedPopulation
+from src.objects.diploid import DiploidPopulation
+from common_imports import *
+
+log = get_logger(__name__)
+
+
+def migration_routes(topology, num_islands):
+    """
+    Destinations for each island's migrants in one migration epoch.
+    :param topology: "ring", "full" or "random"
+    :param num_islands: Number of islands
+    :return: List where entry i holds the islands receiving island i's
+    migrants
+    """
+    islands = range(num_islands)
+    if num_islands < 2:
+        return [[] for _ in islands]
+    if topology == "ring":
+        return [[(idx + 1) % num_islands] for idx in islands]
+    if topology == "full":
+        return [[dest for dest in islands if dest != idx]
+                for idx in islands]
+    if topology == "random":
+        routes = []
+        for idx in islands:
+            dest = random.randrange(num_islands - 1)
+            routes.append([dest + 1 if dest >= idx else dest])
+        return routes
+    raise ValueError(f"Unknown migration topology {topology}")
+
+
+def _migrants(hall_of_fame, num_loci):
+    members = hall_of_fame.queue
+    genes = np.zeros((len(members), num_loci), dtype=np.uint8)
+    for idx, person in enumerate(members):
+        genes[idx] = person.to_array()
+    fitness = np.array([person.fitness for person in members])
+    return np.packbits(genes, axis=1), fitness
+
+
+class IslandError(RuntimeError):
+    """
+    An island worker failed or died.
+    """
+
+
+class _Failure:
+    """
+    Sent by an island worker in place of its next message when it
+    fails, carrying the formatted traceback.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _island(conn, genes, layout, seed, config):
+    """
+    Worker process running one island's GenerationPipeline.  Migrants
+    go to the parent as bit-packed rows at every migration epoch, with
+    the whole island when the parent collects statistics, and the
+    incoming ones replace the island's least fit individuals.  Any
+    exception is sent to the parent before the worker exits.
+    """
+    try:
+        _evolve_island(conn, genes, layout, seed, config)
+    except Exception:
+        conn.send(_Failure(traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def _evolve_island(conn, genes, layout, seed, config):
+    np.random.seed(seed)
+    random.seed(seed)
+    num_chromosomes, num_codons, codon_length = layout
+    pop = PackedPopulation(genes,
+                           codon_length=codon_length,
+                           num_codons=num_codons,
+                           num_chromosomes=num_chromosomes,
+                           hall_of_fame=Fittest(config["num_migrants"],
+                                                dedupe=True))
+    num_loci = pop.num_loci
+    pipeline = GenerationPipeline(
+        Evaluate(config["fitness_func"], cache=config["cache"]),
+        Select(config["selection"]),
+        config["crossover"],
+        SparseMutation(config["p_mutate"]),
+        replace=config["replacement"],
+        observers=[HallOfFameObserver(pop.hall_of_fame)],
+        profiler=config["profiler"])
+    pipeline.start(pop)
+    for gen in range(1, config["generations"] + 1):
+        pipeline.step(pop, gen)
+        if gen % config["interval"] or gen == config["generations"]:
+            continue
+        island = (pop.packed(), pop.fitness) if config["stats"] else None
+        conn.send((_migrants(pop.hall_of_fame, num_loci), island))
+        packed, fitness = conn.recv()
+        if not len(fitness):
+            continue
+        # Incoming migrants replace the least fit residents
+        num = min(len(fitness), pop.population_size)
+        worst = np.argpartition(pop.fitness, num - 1)[:num]
+        new_genes = pop.genes.copy()
+        new_fitness = pop.fitness.copy()
+        new_genes[worst] = np.unpackbits(packed[:num], axis=1,
+                                         count=num_loci)
+        new_fitness[worst] = fitness[:num]
+        pop.replace(new_genes, new_fitness)
+        pipeline.start(pop, gen)
+    conn.send((pop.packed(), pop.fitness,
+               _migrants(pop.hall_of_fame, num_loci), config["profiler"]))
+
+
+class IslandExperiment(Experiment):
+    """
+    Island model: the PackedPopulation is split into num_islands
+    sub-populations, each evolved by the packed generation loop in its
+    own process.  Every migration_interval generations each island
+    sends the num_migrants best individuals from its hall of fame to
+    its neighbours in the migration topology ("ring", "full" or
+    "random"), where they replace the least fit residents.  The
+    fitness function must be picklable.
+
+    Every island runs its own copy of the replacement stage, fitness
+    cache and profiler; island profilers are merged into profiler at
+    the end.  stats sees the whole population at every migration
+    epoch and at the end of the run.
+    """
+
+    def __init__(self,
+                 num_islands=None,
+                 topology="ring",
+                 migration_interval=10,
+                 num_migrants=2,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if not isinstance(self.population, PackedPopulation):
+            raise ValueError("Island experiments need a PackedPopulation")
+        if isinstance(self.population, DiploidPopulation):
+            raise ValueError("Island experiments are haploid only")
+        self._num_islands = num_islands or mp.cpu_count()
+        if self._num_islands > self.population.population_size:
+            raise ValueError(f"{self._num_islands} islands need at "
+                             f"least as many individuals")
+        if num_migrants < 1:
+            raise ValueError("Islands need at least one migrant")
+        self._topology = topology
+        self._migration_interval = migration_interval
+        self._num_migrants = num_migrants
+        # Fail early on a bad topology rather than in the first epoch
+        migration_routes(topology, self._num_islands)
+
+    @property
+    def num_islands(self):
+        return self._num_islands
+
+    @property
+    def topology(self):
+        return self._topology
+
+    @staticmethod
+    def _receive(idx, conn, worker):
+        """
+        Next message from island idx, raising IslandError if the
+        worker failed or died instead.
+        """
+        try:
+            message = conn.recv()
+        except EOFError:
+            worker.join()
+            raise IslandError(f"Island {idx} died with exit code "
+                              f"{worker.exitcode}") from None
+        if isinstance(message, _Failure):
+            worker.join()
+            raise IslandError(f"Island {idx} failed:\n{message.error}")
+        return message
+
+    def _observe(self, generation, packed, fitness):
+        genes = np.concatenate([
+            np.unpackbits(rows, axis=1, count=self.population.num_loci)
+            for rows in packed])
+        self.stats.observe(generation, genes, np.concatenate(fitness))
+        return None
+
+    def _migrate(self, conns, workers):
+        """
+        Relay migrants between the islands every epoch.
+        :return: Final (genes, fitness, migrants, profiler) of every
+        island
+        """
+        islands = list(enumerate(zip(conns, workers)))
+        epochs = (self.generations - 1) // self._migration_interval
+        for epoch in range(1, epochs + 1):
+            messages = [self._receive(idx, conn, worker)
+                        for idx, (conn, worker) in islands]
+            outgoing = [migrants for migrants, _ in messages]
+            if self.stats is not None:
+                self._observe(epoch * self._migration_interval,
+                              [island[0] for _, island in messages],
+                              [island[1] for _, island in messages])
+            incoming = [[] for _ in conns]
+            routes = migration_routes(self._topology, self._num_islands)
+            for source, dests in enumerate(routes):
+                for dest in dests:
+                    incoming[dest].append(outgoing[source])
+            for conn, migrants in zip(conns, incoming):
+                if migrants:
+                    conn.send((np.concatenate([m[0] for m in migrants]),
+                               np.concatenate([m[1] for m in migrants])))
+                else:
+                    conn.send((np.empty((0, 0), np.uint8), np.empty(0)))
+        return [self._receive(idx, conn, worker)
+                for idx, (conn, worker) in islands]
+
+    def run(self):
+        pop = self.population
+        config = {
+            "generations": self.generations,
+            "p_cross": self.p_cross,
+            "p_mutate": self.p_mutate,
+            "fitness_func": self.fitness_func,
+            "selection": self.selection,
+            "crossover": self.crossover,
+            "replacement": self.replacement,
+            "cache": self.cache,
+            "stats": self.stats is not None,
+            "profiler": self.profiler,
+            "interval": self._migration_interval,
+            "num_migrants": self._num_migrants,
+        }
+        shards = np.array_split(pop.genes, self._num_islands)
+        seeds = np.random.randint(0, 2 ** 31, self._num_islands)
+        conns, workers = [], []
+        for shard, seed in zip(shards, seeds.tolist()):
+            parent, child = mp.Pipe()
+            worker = mp.Process(target=_island,
+                                args=(child, shard, pop.layout, seed,
+                                      config),
+                                daemon=True)
+            worker.start()
+            # Only the worker may hold this end, so its death is EOF
+            child.close()
+            conns.append(parent)
+            workers.append(worker)
+        try:
+            results = self._migrate(conns, workers)
+        except BaseException:
+            for worker in workers:
+                worker.terminate()
+            raise
+        for worker in workers:
+            worker.join()
+        genes = np.concatenate([
+            np.unpackbits(result[0], axis=1, count=pop.num_loci)
+            for result in results])
+        fitness = np.concatenate([result[1] for result in results])
+        pop.replace(genes, fitness)
+        if self.stats is not None:
+            self.stats.observe(self.generations, genes, fitness)
+        if self.profiler is not None:
+            for result in results:
+                self.profiler.merge(result[3])
+            if LOG_FLAGS.info:
+                log.info(f"Stage timings:\n{self.profiler.report()}")
+        if pop.hall_of_fame is not None:
+            best = [np.unpackbits(result[2][0], axis=1, count=pop.num_loci)
+                    for result in results]
+            best = PackedPopulation(np.concatenate(best),
+                                    codon_length=pop.codon_length,
+                                    num_codons=pop.num_codons,
+                                    num_chromosomes=pop.num_chromosomes,
+                                    fitness=np.concatenate(
+                                        [result[2][1]
+                                         for result in results]))
+            pop.hall_of_fame.add_many(best.fitness, best.detach)
+        return pop
+
+
+def main():
+    from src.objects.fitness import trap
+
+    pop = PackedPopulation(np.random.randint(0, 2, (4000, 64)),
+                           codon_length=64,
+                           hall_of_fame=Fittest(5))
+    final_pop = IslandExperiment(
+        num_islands=4,
+        topology="ring",
+        migration_interval=5,
+        num_migrants=4,
+        population=pop,
+        generations=50,
+        p_cross=.9,
+        p_mutate=.005,
+        fitness_func=trap(4)
+    ).run()
+    print("Final average fitness: ", final_pop.average_fitness())
+    print(final_pop.hall_of_fame)
+
+
+if __name__ == "__main__":
+    main()
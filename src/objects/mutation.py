@@ -0,0 +1,58 @@
+import numpy as np
+from common_imports import *
+
+log = get_logger(__name__)
+
+
+def mutation_positions(num_loci, p_mutate):
+    """
+    Positions hit by independent per-locus mutation with probability
+    p_mutate, without drawing a random number per locus.  The gaps
+    between consecutive mutations are geometrically distributed, so
+    the cost scales with the number of mutations, not num_loci.
+
+    :param num_loci: Number of loci that can mutate
+    :param p_mutate: Per-locus mutation probability
+    :return: Sorted int64 array of positions in [0, num_loci)
+    """
+    if p_mutate <= 0 or num_loci <= 0:
+        return np.empty(0, dtype=np.int64)
+    if p_mutate >= 1:
+        return np.arange(num_loci, dtype=np.int64)
+    # Enough gaps to cover num_loci in one draw almost always
+    mean = num_loci * p_mutate
+    batch = int(mean + 4 * np.sqrt(mean)) + 1
+    chunks = []
+    last = -1
+    while last < num_loci:
+        positions = last + np.cumsum(np.random.geometric(p_mutate, batch))
+        chunks.append(positions)
+        last = positions[-1]
+    positions = np.concatenate(chunks)
+    return positions[positions < num_loci]
+
+
+def sparse_mutation(genes, p_mutate):
+    """
+    Flip every locus of a gene matrix independently with probability
+    p_mutate, in place, touching only the loci that flip.
+    :param genes: Contiguous gene matrix to mutate
+    :param p_mutate: Per-locus flip probability
+    :return: Number of flipped loci
+    """
+    flat = genes.reshape(-1)
+    positions = mutation_positions(flat.size, p_mutate)
+    flat[positions] ^= 1
+    return len(positions)
+
+
+def main():
+    genes = np.zeros((10000, 1000), dtype=np.uint8)
+    flips = sparse_mutation(genes, .001)
+    print(f"Flipped {flips} of {genes.size} loci, "
+          f"{genes.sum()} set")
+    print(mutation_positions(64, .05))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,579 @@
+from src.objects.chromosome import Chromosome, Codon
+from src.objects.individual import Individual, Population
+from src.objects.fitness import is_batch, is_cacheable, evaluate_batch
+from src.objects.selection import get_selection
+from src.objects.rendering import downsample, show_frame
+from src.utils import helpers as h
+from typing import Iterable
+import numpy as np
+from numpy.random import choice
+from common_imports import *
+
+log = get_logger(__name__)
+
+# Offset that turns a 0/1 gene into the ASCII characters "0"/"1"
+_ASCII_ZERO = ord("0")
+
+
+class CodonView:
+    """
+    Lightweight stand-in for a Codon.  Rather than owning a bitstring
+    it reads its genes straight out of one row of a PackedPopulation
+    gene matrix, so creating one never copies any genetic material.
+    """
+    __slots__ = ("_row", "_start", "_stop")
+
+    def __init__(self, row, start, stop):
+        self._row = row
+        self._start = start
+        self._stop = stop
+
+    def __repr__(self):
+        return self.bitstring
+
+    def __len__(self):
+        return self._stop - self._start
+
+    @property
+    def genes(self):
+        return self._row[self._start:self._stop]
+
+    @property
+    def bitstring(self):
+        return (self.genes + _ASCII_ZERO).tobytes().decode()
+
+    def get_num(self):
+        return self.decode()
+
+    def decode(self):
+        return int(self.bitstring, 2)
+
+    def mutate(self, position):
+        if not 0 <= position < self.__len__():
+            log.error("Position for mutation is out of bounds")
+            return None
+        self._row[self._start + position] ^= 1
+        return None
+
+
+class ChromosomeView:
+    """
+    Chromosome-shaped window onto a slice of a gene matrix row.  The
+    codons are CodonView objects over consecutive, equal-length spans.
+    """
+    __slots__ = ("_row", "_start", "_num_codons", "_codon_lengths")
+
+    def __init__(self, row, start, num_codons, codon_lengths):
+        self._row = row
+        self._start = start
+        self._num_codons = num_codons
+        self._codon_lengths = codon_lengths
+
+    def __repr__(self):
+        return " | ".join(codon.bitstring for codon in self.codons)
+
+    @property
+    def genes(self):
+        stop = self._start + self._num_codons * self._codon_lengths
+        return self._row[self._start:stop]
+
+    @property
+    def codons(self):
+        ans = []
+        for idx in range(self._num_codons):
+            start = self._start + idx * self._codon_lengths
+            ans.append(CodonView(self._row,
+                                 start,
+                                 start + self._codon_lengths))
+        return ans
+
+    @property
+    def num_codons(self):
+        return self._num_codons
+
+    @property
+    def codon_lengths(self):
+        return self._codon_lengths
+
+    def to_list(self):
+        return [(self.genes + _ASCII_ZERO).tobytes().decode()]
+
+    def mutate(self, positions: dict):
+        """
+        Mutate codons within the chromosome at the given positions.
+        :param positions: dictionary of positions to mutate each
+        codon.  Key value pairs are (codon_index, [positions])
+        :return: None
+        """
+        codons = self.codons
+        for codon in positions:
+            for position in positions[codon]:
+                codons[codon].mutate(position)
+        return None
+
+
+class IndividualView:
+    """
+    Individual-shaped view of one row of a PackedPopulation.  Fitness
+    is read from and written to the population's fitness vector, so
+    existing fitness functions that take a list of chromosomes work
+    unchanged.
+    """
+    __slots__ = ("_row", "_fitness_vector", "_index", "_layout")
+
+    def __init__(self, row, fitness_vector, index, layout):
+        self._row = row
+        self._fitness_vector = fitness_vector
+        self._index = index
+        self._layout = layout
+
+    def __repr__(self):
+        chromosomes = self.chromosomes
+        if len(chromosomes) == 1:
+            return chromosomes[0].__repr__()
+        ans = ""
+        for idx, chrom in enumerate(chromosomes):
+            ans += f"Chromosome {idx + 1}:" + chrom.__repr__() + "\n"
+        return ans
+
+    @property
+    def genes(self):
+        return self._row
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def chromosomes(self):
+        num_chromosomes, num_codons, codon_length = self._layout
+        span = num_codons * codon_length
+        return [ChromosomeView(self._row, idx * span, num_codons,
+                               codon_length)
+                for idx in range(num_chromosomes)]
+
+    @property
+    def fitness(self):
+        num = self._fitness_vector[self._index]
+        if np.isnan(num):
+            return None
+        return num.item()
+
+    def update_fitness(self, num):
+        self._fitness_vector[self._index] = num
+        return None
+
+    def apply(self, func, cache=None):
+        if cache is None or not is_cacheable(func):
+            self.update_fitness(func(self.chromosomes))
+            return None
+        cache.bind(func)
+        key = cache.key(self._row)
+        num = cache.get(key)
+        if num is None:
+            num = func(self.chromosomes)
+            cache.put(key, num)
+        self.update_fitness(num)
+        return None
+
+    def mutate(self, positions):
+        for chrom in self.chromosomes:
+            chrom.mutate(positions)
+        return None
+
+    def to_list(self):
+        return (self._row + _ASCII_ZERO).tobytes().decode()
+
+    def to_array(self):
+        return self._row
+
+    def to_individual(self):
+        """
+        Materialize the view into a free-standing Individual.
+        :return: Individual holding a copy of this row's genes
+        """
+        chromosomes = []
+        for chrom in self.chromosomes:
+            chromosomes.append(Chromosome([
+                Codon(bitstring=codon.bitstring, length=len(codon))
+                for codon in chrom.codons
+            ]))
+        person = Individual(chromosomes)
+        person.update_fitness(self.fitness)
+        return person
+
+
+class PackedPopulation:
+    """
+    Population stored as one contiguous uint8 gene matrix with one row
+    per individual and one column per locus, plus a float fitness
+    vector.  Every individual has the same layout of
+    num_chromosomes x num_codons x codon_length loci, laid out
+    chromosome by chromosome and codon by codon along the row.
+
+    Individual, Chromosome and Codon access goes through view objects
+    onto the matrix, so the hot path never allocates per-gene objects.
+    Unevaluated fitness is stored as NaN.
+    """
+
+    def __init__(self,
+                 genes,
+                 codon_length=None,
+                 num_codons=1,
+                 num_chromosomes=1,
+                 fitness=None,
+                 hall_of_fame=None
+                 ):
+        genes = np.ascontiguousarray(genes, dtype=np.uint8)
+        if genes.ndim != 2:
+            raise ValueError("Gene matrix must be two dimensional")
+        if codon_length is None:
+            codon_length = genes.shape[1] // (num_codons *
+                                              num_chromosomes)
+        if num_chromosomes * num_codons * codon_length != genes.shape[1]:
+            raise ValueError(f"Layout {num_chromosomes}x{num_codons}x"
+                             f"{codon_length} does not match "
+                             f"{genes.shape[1]} loci")
+        self._genes = genes
+        self._layout = (num_chromosomes, num_codons, codon_length)
+        if fitness is None:
+            fitness = np.full(genes.shape[0], np.nan)
+        self._fitness = np.asarray(fitness, dtype=np.float64)
+        self._hall_of_fame = hall_of_fame
+        self._selection = None
+
+    def __len__(self):
+        return self.population_size
+
+    def __getitem__(self, idx):
+        return IndividualView(self._genes[idx], self._fitness, idx,
+                              self._layout)
+
+    @classmethod
+    def from_numbers(cls,
+                     nums: Iterable[int],
+                     length=8,
+                     hall_of_fame=None):
+        """
+        Build a single codon population from integers, the packed
+        equivalent of Individual([Chromosome([Codon(num)])]).
+        :param nums: Integers to encode, one per individual
+        :param length: Number of bits per codon
+        :param hall_of_fame: Optional Fittest tracker
+        :return: PackedPopulation
+        """
+        genes = h.get_encoder(max_len=length).encode_many(list(nums))
+        return cls(genes, codon_length=length, hall_of_fame=hall_of_fame)
+
+    @classmethod
+    def from_population(cls, population: Population):
+        """
+        Pack an object population.  All individuals must share the
+        layout of the first one.
+        :param population: Population of Individual objects
+        :return: PackedPopulation holding the same genes and fitness
+        """
+        first = population.individuals[0]
+        num_chromosomes = len(first.chromosomes)
+        num_codons = first.chromosomes[0].num_codons
+        codon_length = first.chromosomes[0].codon_lengths
+        rows = "".join(person.to_list()
+                       for person in population.individuals)
+        genes = np.frombuffer(rows.encode(), dtype=np.uint8) \
+            - _ASCII_ZERO
+        genes = genes.reshape(population.population_size, -1)
+        fitness = [np.nan if person.fitness is None else person.fitness
+                   for person in population.individuals]
+        return cls(genes,
+                   codon_length=codon_length,
+                   num_codons=num_codons,
+                   num_chromosomes=num_chromosomes,
+                   fitness=fitness,
+                   hall_of_fame=population.hall_of_fame)
+
+    @classmethod
+    def from_packed(cls, packed, num_loci, **kwargs):
+        """
+        Rebuild a population from the output of packed().
+        :param packed: Bit-packed gene matrix
+        :param num_loci: Number of loci per individual
+        :return: PackedPopulation
+        """
+        genes = np.unpackbits(packed, axis=1, count=num_loci)
+        return cls(genes, **kwargs)
+
+    @property
+    def genes(self):
+        return self._genes
+
+    @property
+    def fitness(self):
+        return self._fitness
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @property
+    def num_chromosomes(self):
+        return self._layout[0]
+
+    @property
+    def num_codons(self):
+        return self._layout[1]
+
+    @property
+    def codon_length(self):
+        return self._layout[2]
+
+    @property
+    def num_loci(self):
+        return self._genes.shape[1]
+
+    @property
+    def population_size(self):
+        return self._genes.shape[0]
+
+    @property
+    def hall_of_fame(self):
+        return self._hall_of_fame
+
+    @property
+    def individuals(self):
+        return [self[idx] for idx in range(self.population_size)]
+
+    @property
+    def selection(self):
+        """
+        Selection prepared over the current fitness, or None.
+        """
+        return self._selection
+
+    def detach(self, idx):
+        """
+        View onto a private copy of one individual, so keeping it
+        (e.g. in a hall of fame) does not pin the whole gene matrix.
+        :param idx: Row index
+        :return: IndividualView over the copied genes and fitness
+        """
+        return IndividualView(self._genes[idx].copy(),
+                              self._fitness[idx:idx + 1].copy(),
+                              0,
+                              self._layout)
+
+    def packed(self):
+        """
+        Bit-packed copy of the gene matrix, eight loci per byte.
+        :return: uint8 array of shape (population_size, ceil(loci/8))
+        """
+        return np.packbits(self._genes, axis=1)
+
+    def to_array(self):
+        return self._genes
+
+    def decode(self, low=None, high=None, gray=False):
+        """
+        Decode every codon of every individual in one call.
+        :param low: Optional lower end of a real-valued range
+        :param high: Optional upper end of a real-valued range
+        :param gray: Codons are Gray coded
+        :return: Array of shape (population_size, num_chromosomes *
+        num_codons) holding integers, or reals mapped onto [low, high]
+        when a range is given
+        """
+        encoder = h.get_encoder(max_len=self.codon_length)
+        codons = self._genes.reshape(self.population_size, -1,
+                                     self.codon_length)
+        if low is not None and high is not None:
+            return encoder.decode_real_many(codons, low, high, gray)
+        if gray:
+            return encoder.decode_gray_many(codons)
+        return encoder.decode_many(codons)
+
+    def to_population(self):
+        return Population([person.to_individual()
+                           for person in self.individuals],
+                          hall_of_fame=self._hall_of_fame)
+
+    def replace(self, genes, fitness=None):
+        """
+        Swap in a new generation of genes.  Fresh arrays are bound
+        rather than written in place so views handed out earlier (e.g.
+        to a hall of fame) keep pointing at the genes they were made
+        from.
+        :param genes: New gene matrix with the same layout
+        :param fitness: Optional fitness vector for the new genes
+        :return: None
+        """
+        genes = np.ascontiguousarray(genes, dtype=np.uint8)
+        if genes.shape[1] != self.num_loci:
+            log.error("Replacement genes do not match population layout")
+            return None
+        self._genes = genes
+        if fitness is None:
+            fitness = np.full(genes.shape[0], np.nan)
+        self._fitness = np.asarray(fitness, dtype=np.float64)
+        self._selection = None
+        return None
+
+    def update(self, rows, genes):
+        """
+        Overwrite some individuals in place with new, unevaluated
+        genes.  Unlike replace(), the gene matrix and fitness vector
+        are kept, so the rest of the population keeps its fitness and
+        apply_fitness(rows=rows) only has to evaluate the newcomers.
+        :param rows: Distinct row indices to overwrite
+        :param genes: Gene matrix with one row per index
+        :return: None
+        """
+        genes = np.asarray(genes, dtype=np.uint8)
+        if genes.ndim != 2 or genes.shape[1] != self.num_loci:
+            log.error("Replacement genes do not match population layout")
+            return None
+        self._genes[rows] = genes
+        self._fitness[rows] = np.nan
+        return None
+
+    def apply_fitness(self, func, pool=None, cache=None, rows=None):
+        """
+        Evaluate fitness for the whole population.  Batch capable
+        functions get the gene matrix and fill the fitness vector in
+        one call; anything else is applied individual by individual.
+        :param func: Fitness function
+        :param pool: Optional FitnessPool to evaluate in parallel
+        :param cache: Optional FitnessCache; only genomes it has not
+        seen are evaluated
+        :param rows: Optional distinct row indices to evaluate; the
+        others keep their fitness and a prepared selection is updated
+        rather than dropped
+        :return: None
+        """
+        def evaluate(rows):
+            if pool is not None:
+                return pool.evaluate(func, self._genes[rows],
+                                     self._layout)
+            if is_batch(func):
+                return evaluate_batch(func, self._genes[rows])
+            for idx in rows:
+                self[idx].apply(func)
+            return self._fitness[rows]
+
+        if rows is None:
+            self._selection = None
+            if cache is not None and is_cacheable(func):
+                self._fitness[:] = cache.evaluate(func, self._genes,
+                                                  evaluate)
+            else:
+                self._fitness[:] = evaluate(
+                    np.arange(self.population_size))
+            return None
+        rows = np.asarray(rows, dtype=np.int64)
+        if cache is not None and is_cacheable(func):
+            values = cache.evaluate(func, self._genes[rows],
+                                    lambda sub: evaluate(rows[sub]))
+        else:
+            values = evaluate(rows)
+        self._fitness[rows] = values
+        if self._selection is not None:
+            self._selection.update(rows, self._fitness[rows])
+        return None
+
+    def average_fitness(self):
+        return self._fitness.mean()
+
+    def prepare_selection(self, method="roulette", **kwargs):
+        """
+        Build a selection strategy over the current fitness vector.
+        The prepared strategy is reused by sample_population until
+        fitness is re-applied or the genes are replaced.
+        :param method: Name from SELECTION_METHODS or a Selection
+        :param kwargs: Parameters for the strategy
+        :return: Prepared Selection object, None for unknown methods
+        """
+        selection = get_selection(method, **kwargs)
+        if selection is not None:
+            selection.prepare(self._fitness)
+        self._selection = selection
+        return selection
+
+    def sample_population(self, num, method="roulette"):
+        """
+        Sample the population with the given selection method.  The
+        default roulette wheel makes the probability of being selected
+        an individual's fraction of the total fitness.
+        :param num: Number of individuals to return
+        :param method: Type of sampling to use (roulette is default),
+        see SELECTION_METHODS, or a Selection object
+        :return: Tuple of IndividualView objects drawn from the
+        population
+        """
+        selection = self._selection
+        if selection is None \
+                or (method is not selection and method != selection.name):
+            selection = self.prepare_selection(method)
+        if selection is None:
+            return tuple(num * [None])
+        return tuple(self[idx] for idx in selection.draw(num))
+
+    def draw(self, ax, canvas, max_rows=512):
+        """
+        Show the population on ax, reusing the axis' image if it has
+        one of the same shape.  Populations above max_rows are binned.
+        """
+        show_frame(ax, downsample(self._genes, max_rows), canvas)
+        return None
+
+    def evolve_one_step(self,
+                        p_cross,
+                        p_mutate,
+                        fitness_func,
+                        pool=None,
+                        cache=None,
+                        selection="roulette",
+                        crossover="single",
+                        replacement="generational"
+                        ):
+        """
+        Breed a whole generation at once through the default
+        GenerationPipeline: one selection draw for all parents,
+        crossover of every pair through a swap mask, and sparse
+        mutation of the whole child matrix.
+        :param p_cross: Probability a mating pair is crossed over
+        :param p_mutate: Per-locus mutation probability
+        :param fitness_func: Fitness function taking a list of
+        chromosomes
+        :param pool: Optional FitnessPool to evaluate in parallel
+        :param cache: Optional FitnessCache
+        :param selection: Selection method name or Selection object
+        :param crossover: Crossover method name or Crossover object
+        :param replacement: Replacement method name or Replacement
+        object
+        :return: None
+        """
+        from src.objects.experiment import GenerationPipeline
+
+        GenerationPipeline.build(p_cross, p_mutate, fitness_func,
+                                 pool=pool,
+                                 cache=cache,
+                                 selection=selection,
+                                 hall_of_fame=self.hall_of_fame,
+                                 crossover=crossover,
+                                 replacement=replacement
+                                 ).step(self)
+        return None
+
+
+def main():
+    from src.objects.experiment import number_ones
+
+    pop = PackedPopulation.from_numbers(choice(range(256), 5))
+    pop.apply_fitness(number_ones)
+    for person in pop.individuals:
+        print(person, person.fitness)
+    print("Average fitness: ", pop.average_fitness())
+    print(pop.packed())
+    print(pop.to_population().to_array())
+
+
+if __name__ == "__main__":
+    main()
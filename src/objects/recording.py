@@ -0,0 +1,219 @@
+import json
+import queue
+import threading
+import zlib
+from pathlib import Path
+import numpy as np
+from src.objects.rendering import downsample
+from common_imports import *
+
+log = get_logger(__name__)
+
+META = "meta.json"
+FRAMES = "frames.bin"
+FITNESS = "fitness.f64"
+
+# generation, rows, columns, compressed size
+_HEADER = np.dtype([("generation", "<i8"), ("rows", "<i8"),
+                    ("columns", "<i8"), ("size", "<i8")])
+
+
+class FrameRecorder:
+    """
+    Headless recording of an experiment.  Used as an observer, it
+    downsamples every generation (see downsample) into an 8 bit image,
+    takes the min/mean/max fitness, and hands both to a background
+    writer thread that appends them to a frame store in the directory
+    path: zlib-compressed frames in frames.bin and the fitness curves
+    in fitness.f64.  Read it back with read_frames and read_fitness, or
+    encode it with export_animation.
+
+    The queue to the writer holds maxsize generations; if the disk
+    falls behind, the experiment waits rather than losing frames.
+    Only every every-th generation is recorded.  close() flushes the
+    queue and stops the writer.
+    """
+
+    def __init__(self, path, max_rows=512, render_mode="bin", every=1,
+                 maxsize=16, level=1):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._max_rows = max_rows
+        self._render_mode = render_mode
+        self._every = every
+        self._level = level
+        self._queue = queue.Queue(maxsize)
+        self._recorded = 0
+        self._error = None
+        self._reported = False
+        with open(self._path / META, "w") as f:
+            json.dump({"max_rows": max_rows,
+                       "render_mode": render_mode,
+                       "every": every}, f)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def recorded(self):
+        return self._recorded
+
+    def observe(self, population, generation, rows=None):
+        if generation % self._every:
+            return None
+        if self._error is not None:
+            if not self._reported:
+                log.error(f"Recording to {self._path} failed: "
+                          f"{self._error}")
+                self._reported = True
+            return None
+        frame = downsample(population.genes, self._max_rows,
+                           self._render_mode)
+        image = np.multiply(frame, 255, out=frame).round(out=frame) \
+            .astype(np.uint8)
+        fitness = population.fitness
+        curve = np.array([generation, fitness.min(), fitness.mean(),
+                          fitness.max()])
+        self._queue.put((generation, image, curve))
+        self._recorded += 1
+        return None
+
+    def _write(self):
+        with open(self._path / FRAMES, "ab") as frames, \
+                open(self._path / FITNESS, "ab") as curves:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return None
+                if self._error is not None:
+                    continue
+                generation, image, curve = item
+                try:
+                    payload = zlib.compress(image.tobytes(), self._level)
+                    header = np.array([(generation, *image.shape,
+                                        len(payload))], dtype=_HEADER)
+                    frames.write(header.tobytes())
+                    frames.write(payload)
+                    curves.write(curve.tobytes())
+                except OSError as error:
+                    self._error = error
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        return None
+
+
+def read_frames(path):
+    """
+    Iterate over a frame store written by FrameRecorder.
+    :param path: Recording directory
+    :return: Generator of (generation, float32 frame in [0, 1])
+    """
+    with open(Path(path) / FRAMES, "rb") as f:
+        while True:
+            raw = f.read(_HEADER.itemsize)
+            if len(raw) < _HEADER.itemsize:
+                return
+            header = np.frombuffer(raw, dtype=_HEADER)[0]
+            payload = f.read(int(header["size"]))
+            image = np.frombuffer(zlib.decompress(payload), np.uint8)
+            yield int(header["generation"]), \
+                image.reshape(int(header["rows"]),
+                              int(header["columns"])) / np.float32(255)
+
+
+def read_fitness(path):
+    """
+    Fitness curves of a recording.
+    :param path: Recording directory
+    :return: Dict of generation, min, mean and max arrays
+    """
+    curves = np.fromfile(Path(path) / FITNESS).reshape(-1, 4)
+    return dict(zip(("generation", "min", "mean", "max"), curves.T))
+
+
+def export_animation(path, filename, fps=10):
+    """
+    Encode a recording as an animated GIF with the population image
+    next to the fitness curves, using matplotlib's PillowWriter.
+    :param path: Recording directory
+    :param filename: Output file, e.g. "run.gif"
+    :param fps: Frames per second
+    :return: Number of frames written, or None if Pillow is missing
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.animation import PillowWriter
+
+    if not PillowWriter.isAvailable():
+        log.error("Exporting an animation needs Pillow")
+        return None
+    curves = read_fitness(path)
+    # A bare Agg figure leaves any pyplot backend in use untouched
+    fig = Figure(figsize=(10, 4))
+    FigureCanvasAgg(fig)
+    image_ax, curve_ax = fig.subplots(1, 2)
+    image_ax.axis("off")
+    curve_ax.set_xlabel("Generation")
+    curve_ax.set_ylabel("Fitness")
+    lines = [curve_ax.plot([], [], label=column)[0]
+             for column in ("min", "mean", "max")]
+    curve_ax.legend(loc="lower right")
+    if len(curves["generation"]):
+        curve_ax.set_xlim(curves["generation"][0],
+                          max(curves["generation"][-1],
+                              curves["generation"][0] + 1))
+        low, high = curves["min"].min(), curves["max"].max()
+        curve_ax.set_ylim(low, high + (high == low))
+    image = None
+    writer = PillowWriter(fps=fps)
+    num = 0
+    with writer.saving(fig, filename, fig.dpi):
+        for idx, (generation, frame) in enumerate(read_frames(path)):
+            if image is None:
+                image = image_ax.imshow(frame, vmin=0, vmax=1,
+                                        aspect="auto",
+                                        interpolation="nearest")
+            else:
+                image.set_data(frame)
+            image_ax.set_title(f"Generation {generation}")
+            for line, column in zip(lines, ("min", "mean", "max")):
+                line.set_data(curves["generation"][:idx + 1],
+                              curves[column][:idx + 1])
+            writer.grab_frame()
+            num += 1
+    return num
+
+
+def main():
+    import tempfile
+    from src.objects.fitness import number_ones
+    from src.objects.packed import PackedPopulation
+
+    pop = PackedPopulation(np.random.randint(0, 2, (2000, 64)),
+                           codon_length=64)
+    with tempfile.TemporaryDirectory() as folder:
+        with FrameRecorder(folder, max_rows=100) as recorder:
+            for generation in range(20):
+                pop.evolve_one_step(.9, .005, number_ones)
+                recorder.observe(pop, generation + 1)
+        frames = list(read_frames(folder))
+        print(f"{len(frames)} frames of shape {frames[0][1].shape}")
+        print("Mean fitness: ", read_fitness(folder)["mean"].round(2))
+        print("GIF frames: ",
+              export_animation(folder, Path(folder) / "run.gif"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import threading
+from collections import deque
+import numpy as np
+from src.objects.statistics import allele_counts
+from common_imports import *
+
+log = get_logger(__name__)
+
+RENDER_MODES = ("bin", "alleles")
+
+
+def frame_shape(num_rows, num_loci, max_rows=512, mode="bin"):
+    """
+    Shape of the image downsample() makes from a gene matrix.
+    """
+    if mode == "alleles":
+        return 1, num_loci
+    if num_rows <= max_rows:
+        return num_rows, num_loci
+    rows_per_bin = -(-num_rows // max_rows)
+    return -(-num_rows // rows_per_bin), num_loci
+
+
+def downsample(genes, max_rows=512, mode="bin", out=None):
+    """
+    Image of a gene matrix with at most max_rows rows.  Small
+    populations are copied as is.  Larger ones are binned ("bin"):
+    each image row is the frequency of 1 alleles over a run of
+    consecutive individuals.  "alleles" gives a single row of per-locus
+    allele frequencies over the whole population.
+    :param genes: 2-D gene matrix
+    :param max_rows: Most image rows, e.g. the screen height
+    :param mode: One of RENDER_MODES
+    :param out: Optional float32 array of frame_shape to fill
+    :return: float32 image with values in [0, 1]
+    """
+    num_rows, num_loci = genes.shape
+    shape = frame_shape(num_rows, num_loci, max_rows, mode)
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    if mode == "alleles":
+        np.divide(allele_counts(genes), max(num_rows, 1), out=out[0])
+        return out
+    if num_rows <= max_rows:
+        out[:] = genes
+        return out
+    rows_per_bin = -(-num_rows // max_rows)
+    full = num_rows // rows_per_bin
+    np.add.reduce(
+        genes[:full * rows_per_bin].reshape(full, rows_per_bin, num_loci),
+        axis=1, dtype=np.float32, out=out[:full])
+    out[:full] *= 1 / rows_per_bin
+    if full < len(out):
+        # Last, partial bin
+        out[full] = genes[full * rows_per_bin:].mean(axis=0)
+    return out
+
+
+def show_frame(ax, frame, canvas=None):
+    """
+    Draw a frame on ax, updating the axis' existing image in place
+    when it has the same shape rather than adding a new artist.
+    :return: The AxesImage
+    """
+    if ax.images and ax.images[-1].get_array().shape == frame.shape:
+        image = ax.images[-1]
+        image.set_data(frame)
+    else:
+        for image in list(ax.images):
+            image.remove()
+        image = ax.imshow(frame, vmin=0, vmax=1, aspect="auto",
+                          interpolation="nearest")
+    if canvas is not None:
+        canvas.draw_idle()
+    return image
+
+
+class FrameRenderer:
+    """
+    Downsamples gene matrices into a ring of preallocated float32
+    frames, so rendering a generation allocates nothing.  Each slot
+    is overwritten again slots frames later, so keep slots above the
+    number of frames a FrameBuffer holds plus the one on display.
+    """
+
+    def __init__(self, max_rows=512, mode="bin", slots=8):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode {mode}")
+        self._max_rows = max_rows
+        self._mode = mode
+        self._slots = [None] * slots
+        self._next = 0
+
+    @property
+    def max_rows(self):
+        return self._max_rows
+
+    @property
+    def mode(self):
+        return self._mode
+
+    def frame(self, genes):
+        """
+        :param genes: 2-D gene matrix
+        :return: The next frame slot, filled from genes
+        """
+        shape = frame_shape(*genes.shape, self._max_rows, self._mode)
+        out = self._slots[self._next]
+        if out is None or out.shape != shape:
+            out = self._slots[self._next] = np.empty(shape, np.float32)
+        self._next = (self._next + 1) % len(self._slots)
+        return downsample(genes, self._max_rows, self._mode, out)
+
+
+class FrameBuffer:
+    """
+    Bounded ring buffer of (generation, frame) pairs between an
+    evolution thread and a display.  publish() never blocks: once
+    maxsize frames are waiting the oldest is overwritten.  latest()
+    hands the display the newest frame and drops the stale ones, so
+    the evolution rate never depends on the display rate.
+    """
+
+    def __init__(self, maxsize=4):
+        self._frames = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+        self._published = 0
+        self._shown = 0
+        self._closed = False
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def published(self):
+        return self._published
+
+    @property
+    def shown(self):
+        return self._shown
+
+    @property
+    def dropped(self):
+        """
+        Frames that were overwritten or skipped before being shown.
+        """
+        return self._published - self._shown - len(self._frames)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def finished(self):
+        """
+        Closed by the producer, with every remaining frame consumed.
+        """
+        return self._closed and not self._frames
+
+    def publish(self, generation, frame):
+        with self._lock:
+            self._frames.append((generation, frame))
+            self._published += 1
+        return None
+
+    def latest(self):
+        """
+        Take the newest frame, discarding any older ones.
+        :return: (generation, frame), or None if nothing new arrived
+        """
+        with self._lock:
+            if not self._frames:
+                return None
+            ans = self._frames.pop()
+            self._frames.clear()
+            self._shown += 1
+        return ans
+
+    def close(self):
+        self._closed = True
+        return None
+
+
+class FramePlayer:
+    """
+    Displays the newest frame of a FrameBuffer on a matplotlib axis,
+    driven by a Tk after() timer so the GUI thread only ever draws.
+    The image artist is created once and updated with set_data; on
+    canvases that support it, only the image and the generation label
+    are redrawn over a cached background (blitting).
+    """
+
+    def __init__(self, window, ax, canvas, frames, interval=.1):
+        self._window = window
+        self._ax = ax
+        self._canvas = canvas
+        self._frames = frames
+        self._interval = max(1, int(interval * 1000))
+        self._image = None
+        self._label = None
+        self._background = None
+        self._job = None
+
+    @property
+    def running(self):
+        return self._job is not None
+
+    def _setup(self, frame):
+        self._ax.clear()
+        self._ax.axis("off")
+        blit = self._canvas is not None \
+            and getattr(self._canvas, "supports_blit", False)
+        self._image = self._ax.imshow(frame, vmin=0, vmax=1,
+                                      aspect="auto",
+                                      interpolation="nearest",
+                                      animated=blit)
+        self._label = self._ax.text(.01, .99, "",
+                                    transform=self._ax.transAxes,
+                                    va="top", color="white",
+                                    animated=blit)
+        self._background = None
+        if blit:
+            self._canvas.draw()
+            self._background = self._canvas.copy_from_bbox(
+                self._ax.bbox)
+        return None
+
+    def render(self):
+        """
+        Draw the newest frame, if there is one.
+        :return: Generation drawn, or None
+        """
+        item = self._frames.latest()
+        if item is None:
+            return None
+        generation, frame = item
+        if self._image is None \
+                or self._image.get_array().shape != frame.shape:
+            self._setup(frame)
+        self._image.set_data(frame)
+        self._label.set_text(f"Generation {generation}")
+        if self._background is not None:
+            self._canvas.restore_region(self._background)
+            self._ax.draw_artist(self._image)
+            self._ax.draw_artist(self._label)
+            self._canvas.blit(self._ax.bbox)
+        elif self._canvas is not None:
+            self._canvas.draw_idle()
+        return generation
+
+    def _tick(self):
+        self.render()
+        if self._frames.finished:
+            self._job = None
+            return None
+        self._job = self._window.after(self._interval, self._tick)
+        return None
+
+    def start(self):
+        if self._job is None:
+            self._tick()
+        return None
+
+    def stop(self):
+        if self._job is not None:
+            self._window.after_cancel(self._job)
+            self._job = None
+        return None
+
+
+def main():
+    frames = FrameBuffer(maxsize=3)
+    for generation in range(10):
+        frames.publish(generation, np.random.randint(0, 2, (4, 8)))
+    print(frames.latest()[0], frames.published, frames.dropped)
+    genes = np.random.randint(0, 2, (100000, 16), dtype=np.uint8)
+    renderer = FrameRenderer(max_rows=8)
+    print(renderer.frame(genes).round(2))
+
+
+if __name__ == "__main__":
+    main()
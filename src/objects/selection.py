@@ -0,0 +1,360 @@
+import numpy as np
+from common_imports import *
+
+log = get_logger(__name__)
+
+# Below this many individuals rebuilding a cumulative table beats
+# patching a FenwickTree, whose cost is mostly per-call overhead
+MIN_PATCH_SIZE = 2 ** 15
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over a vector of non-negative weights.  Point
+    updates and finding where the running total passes a point both
+    cost O(log n), and both work on many indices or points at once.
+    The tree is rebuilt from the weights after every n updates, so
+    round off from patching never builds up.
+    """
+
+    def __init__(self, weights):
+        self._weights = np.array(weights, dtype=np.float64)
+        self._tree = None
+        self._total = 0.
+        self._updates = 0
+        self.rebuild()
+
+    def __len__(self):
+        return len(self._weights)
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def total(self):
+        return self._total
+
+    def rebuild(self):
+        size = len(self._weights)
+        cumulative = np.zeros(size + 1)
+        np.cumsum(self._weights, out=cumulative[1:])
+        # Node i holds the weights of (i - lowbit(i), i]
+        nodes = np.arange(size + 1)
+        self._tree = cumulative - cumulative[nodes - (nodes & -nodes)]
+        self._total = cumulative[-1]
+        self._updates = 0
+        return None
+
+    def update(self, indices, weights):
+        """
+        Set the weights at indices, which must be distinct.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        delta = weights - self._weights[indices]
+        self._weights[indices] = weights
+        self._updates += len(indices)
+        if self._updates >= len(self._weights):
+            return self.rebuild()
+        self._total += delta.sum()
+        nodes = indices + 1
+        while len(nodes):
+            np.add.at(self._tree, nodes, delta)
+            nodes = nodes + (nodes & -nodes)
+            inside = nodes < len(self._tree)
+            nodes, delta = nodes[inside], delta[inside]
+        return None
+
+    def find(self, points):
+        """
+        For each point in [0, total), the index of the first weight at
+        which the running total exceeds it.
+        """
+        size = len(self._weights)
+        ans = np.zeros(len(points), dtype=np.int64)
+        rest = np.array(points, dtype=np.float64)
+        step = 1 << max(size.bit_length() - 1, 0)
+        while step:
+            nodes = ans + step
+            node_sums = self._tree[np.minimum(nodes, size)]
+            take = (nodes <= size) & (node_sums <= rest)
+            ans[take] = nodes[take]
+            rest[take] -= node_sums[take]
+            step >>= 1
+        return np.minimum(ans, size - 1)
+
+
+class Selection:
+    """
+    Base class for selection strategies.  prepare() is called once per
+    generation with the fitness vector and does all the per-generation
+    work (cumulative tables, ranks, ...), so each draw() is O(1) or
+    O(log n) per selected individual.
+    """
+    name = None
+
+    def __init__(self):
+        self._fitness = None
+
+    def __getstate__(self):
+        # Prepared tables are rebuilt every generation, so pickles
+        # (checkpoints, worker processes) only carry the parameters
+        state = self.__dict__.copy()
+        for key in state:
+            if key.startswith("_") and isinstance(
+                    state[key], (np.ndarray, FenwickTree)):
+                state[key] = None
+        return state
+
+    @property
+    def size(self):
+        return 0 if self._fitness is None else len(self._fitness)
+
+    def prepare(self, fitness):
+        self._fitness = np.asarray(fitness, dtype=np.float64)
+        return None
+
+    def update(self, indices, fitness):
+        """
+        Change the fitness of some individuals after prepare().  This
+        default rebuilds everything; strategies that can patch their
+        tables override it.
+        :param indices: Distinct indices of the changed individuals
+        :param fitness: Their new fitness values
+        :return: None
+        """
+        self._fitness[indices] = fitness
+        return self.prepare(self._fitness)
+
+    def draw(self, num):
+        """
+        Select individuals from the prepared fitness vector.
+        :param num: Number of individuals to select
+        :return: Integer array of selected indices
+        """
+        raise NotImplementedError
+
+
+class CumulativeSelection(Selection):
+    """
+    Selection proportional to a weight per individual.  The weights are
+    turned into a cumulative table once, and every draw is a binary
+    search into it.
+
+    Strategies whose weight depends only on the individual's own
+    fitness set local_weights.  update() then moves the weights into a
+    FenwickTree and patches it, rather than rebuilding the table.
+    """
+    local_weights = False
+
+    def __init__(self):
+        super().__init__()
+        self._table = None
+        self._weights = None
+        self._tree = None
+
+    @property
+    def total(self):
+        if self._tree is not None:
+            return self._tree.total
+        return self._table[-1]
+
+    def weights(self, fitness):
+        raise NotImplementedError
+
+    def prepare(self, fitness):
+        super().prepare(fitness)
+        weights = self.weights(self._fitness)
+        self._weights = weights
+        if weights.sum() <= 0:
+            log.warning("No positive selection weight, sampling "
+                        "uniformly")
+            weights = np.ones_like(weights)
+            self._weights = None
+        self._table = np.cumsum(weights)
+        self._tree = None
+        return None
+
+    def update(self, indices, fitness):
+        indices = np.asarray(indices, dtype=np.int64)
+        # Patching costs O(log n) per individual, rebuilding O(n)
+        uniform = self._tree is None and self._weights is None
+        if not self.local_weights or uniform \
+                or self.size < MIN_PATCH_SIZE \
+                or len(indices) * self.size.bit_length() > self.size:
+            return super().update(indices, fitness)
+        self._fitness[indices] = fitness
+        if self._tree is None:
+            self._tree = FenwickTree(self._weights)
+            self._table = self._weights = None
+        self._tree.update(indices, self.weights(self._fitness[indices]))
+        if self._tree.total <= 0:
+            return self.prepare(self._fitness)
+        return None
+
+    def lookup(self, points):
+        if self._tree is not None:
+            return self._tree.find(points)
+        # Clip guards against floating point round off at the top end
+        return np.minimum(
+            np.searchsorted(self._table, points, side="right"),
+            self.size - 1)
+
+    def draw(self, num):
+        return self.lookup(np.random.random(num) * self.total)
+
+
+class RouletteSelection(CumulativeSelection):
+    """
+    Roulette wheel: probability of selection is an individual's share
+    of the total fitness.
+    """
+    name = "roulette"
+    local_weights = True
+
+    def weights(self, fitness):
+        if (fitness < 0).any():
+            log.error("Roulette selection needs non-negative fitness")
+        return np.clip(fitness, 0, None)
+
+
+class RankSelection(CumulativeSelection):
+    """
+    Linear ranking: probability of selection grows with rank rather
+    than raw fitness.  pressure in [1, 2] is the expected number of
+    copies of the best individual.
+    """
+    name = "rank"
+
+    def __init__(self, pressure=1.5):
+        super().__init__()
+        self._pressure = pressure
+
+    def weights(self, fitness):
+        size = len(fitness)
+        ranks = np.empty(size)
+        ranks[np.argsort(fitness, kind="stable")] = np.arange(size)
+        if size == 1:
+            return np.ones(1)
+        return 2 - self._pressure \
+            + 2 * (self._pressure - 1) * ranks / (size - 1)
+
+
+class BoltzmannSelection(CumulativeSelection):
+    """
+    Boltzmann selection: weights exp(fitness / temperature).  Low
+    temperatures approach picking the best, high ones uniform choice.
+    """
+    name = "boltzmann"
+
+    def __init__(self, temperature=1.):
+        super().__init__()
+        self._temperature = temperature
+
+    def weights(self, fitness):
+        # Shift by the max so the exponent never overflows
+        return np.exp((fitness - fitness.max()) / self._temperature)
+
+
+class StochasticUniversalSampling(RouletteSelection):
+    """
+    Fitness proportionate selection with a single spin and num evenly
+    spaced pointers, which keeps the spread of copies per individual
+    minimal.  Results are shuffled so consecutive picks pair randomly.
+    """
+    name = "sus"
+
+    def draw(self, num):
+        if not num:
+            return np.zeros(0, dtype=np.int64)
+        step = self.total / num
+        points = np.random.random() * step + step * np.arange(num)
+        ans = self.lookup(points)
+        np.random.shuffle(ans)
+        return ans
+
+
+class TournamentSelection(Selection):
+    """
+    Each pick is the fittest of tournament_size individuals drawn
+    uniformly with replacement.
+    """
+    name = "tournament"
+
+    def __init__(self, tournament_size=2):
+        super().__init__()
+        self._tournament_size = tournament_size
+
+    def update(self, indices, fitness):
+        # Nothing is prepared beyond the fitness vector itself
+        self._fitness[indices] = fitness
+        return None
+
+    def draw(self, num):
+        entrants = np.random.randint(0, self.size,
+                                     (num, self._tournament_size))
+        winners = self._fitness[entrants].argmax(axis=1)
+        return entrants[np.arange(num), winners]
+
+
+class TruncationSelection(Selection):
+    """
+    Uniform choice among the top fraction of the population.
+    """
+    name = "truncation"
+
+    def __init__(self, fraction=.5):
+        super().__init__()
+        self._fraction = fraction
+        self._top = None
+
+    def prepare(self, fitness):
+        super().prepare(fitness)
+        keep = max(1, int(round(self._fraction * self.size)))
+        self._top = np.argpartition(self._fitness, -keep)[-keep:]
+        return None
+
+    def draw(self, num):
+        return self._top[np.random.randint(0, len(self._top), num)]
+
+
+SELECTION_METHODS = {
+    method.name: method for method in (
+        RouletteSelection,
+        RankSelection,
+        BoltzmannSelection,
+        StochasticUniversalSampling,
+        TournamentSelection,
+        TruncationSelection,
+    )
+}
+
+
+def get_selection(method="roulette", **kwargs):
+    """
+    Build a selection strategy by name.
+    :param method: Key of SELECTION_METHODS, or a Selection instance
+    which is returned unchanged
+    :param kwargs: Parameters for the strategy, e.g. tournament_size
+    :return: Selection object, or None for unknown methods
+    """
+    if isinstance(method, Selection):
+        return method
+    if method not in SELECTION_METHODS:
+        log.error(f"Method {method} not implemented")
+        return None
+    return SELECTION_METHODS[method](**kwargs)
+
+
+def main():
+    fitness = np.random.randint(0, 9, 10)
+    print("Fitness: ", fitness)
+    for method in SELECTION_METHODS:
+        selection = get_selection(method)
+        selection.prepare(fitness)
+        print(f"{method:>10}: ", selection.draw(10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import os
+import numpy as np
+from src.objects.fitness import is_batch, evaluate_batch
+from src.objects.packed import PackedPopulation
+from common_imports import *
+
+log = get_logger(__name__)
+
+# Segments this process has attached to, by name, so workers of a
+# persistent pool map each segment once rather than once per task.
+# Least recently used first: a worker closes its oldest mappings once
+# it holds MAX_ATTACHED, and a stale mapping as soon as its name is
+# reused by a new segment.
+_ATTACHED = OrderedDict()
+MAX_ATTACHED = 4
+
+
+def _segment_arrays(buf, population_size, num_loci):
+    """
+    Lay out a segment as two gene buffers (current and next
+    generation) followed by the fitness vector.
+    """
+    genes_bytes = 2 * population_size * num_loci
+    # Keep the float64 fitness vector 8 byte aligned
+    offset = -(-genes_bytes // 8) * 8
+    buffers = np.ndarray((2, population_size, num_loci),
+                         dtype=np.uint8, buffer=buf)
+    fitness = np.ndarray((population_size,), dtype=np.float64,
+                         buffer=buf, offset=offset)
+    return buffers, fitness
+
+
+def _segment_size(population_size, num_loci):
+    return -(-2 * population_size * num_loci // 8) * 8 \
+        + 8 * population_size
+
+
+class SharedPopulation(PackedPopulation):
+    """
+    PackedPopulation whose gene matrix and fitness vector live in a
+    named multiprocessing.shared_memory segment.  Worker processes
+    attach by name (see spec and attach), so evaluating or breeding a
+    generation only sends index ranges between processes; a
+    GenerationPipeline running with a pool does both in the workers.
+
+    The segment holds two gene buffers.  Workers breed the next
+    generation straight into the idle one and replace() flips
+    between them, so no generation is copied.  Call close() when done;
+    the creating process also unlinks the segment.
+    """
+
+    def __init__(self,
+                 genes,
+                 codon_length=None,
+                 num_codons=1,
+                 num_chromosomes=1,
+                 fitness=None,
+                 hall_of_fame=None,
+                 name=None,
+                 create=True,
+                 current=0,
+                 token=None):
+        genes = np.asarray(genes, dtype=np.uint8)
+        size, num_loci = genes.shape
+        if create:
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=True,
+                size=max(_segment_size(size, num_loci), 1))
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = create
+        # Tells a new segment from an old one that reused its name
+        self._token = os.urandom(8).hex() if token is None else token
+        self._buffers, shared_fitness = _segment_arrays(self._shm.buf,
+                                                        size, num_loci)
+        self._current = current
+        if create:
+            self._buffers[current] = genes
+            shared_fitness[:] = np.nan if fitness is None else fitness
+        super().__init__(self._buffers[current],
+                         codon_length=codon_length,
+                         num_codons=num_codons,
+                         num_chromosomes=num_chromosomes,
+                         fitness=shared_fitness,
+                         hall_of_fame=hall_of_fame)
+
+    @classmethod
+    def from_packed_population(cls, population: PackedPopulation,
+                               name=None):
+        num_chromosomes, num_codons, codon_length = population.layout
+        return cls(population.genes,
+                   codon_length=codon_length,
+                   num_codons=num_codons,
+                   num_chromosomes=num_chromosomes,
+                   fitness=population.fitness,
+                   hall_of_fame=population.hall_of_fame,
+                   name=name)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attach to a segment created in another process.
+        :param spec: The creating population's spec
+        :return: SharedPopulation over the same memory
+        """
+        name, size, layout, current, token = spec
+        num_chromosomes, num_codons, codon_length = layout
+        genes = np.empty((size, num_chromosomes * num_codons
+                          * codon_length), dtype=np.uint8)
+        return cls(genes,
+                   codon_length=codon_length,
+                   num_codons=num_codons,
+                   num_chromosomes=num_chromosomes,
+                   name=name,
+                   create=False,
+                   current=current,
+                   token=token)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def spec(self):
+        """
+        Everything a worker needs to attach: (name, population_size,
+        layout, index of the current gene buffer, segment token).
+        """
+        return self.name, self.population_size, self._layout, \
+            self._current, self._token
+
+    @property
+    def next_genes(self):
+        """
+        The idle gene buffer that the next generation is bred into.
+        """
+        return self._buffers[1 - self._current]
+
+    def replace(self, genes, fitness=None):
+        """
+        Make genes the current generation.  Passing next_genes just
+        flips buffers; anything else is copied into the idle buffer
+        first.  Views of the old generation are overwritten by the
+        generation after next, so keep detached copies if needed.
+        """
+        genes = np.asarray(genes, dtype=np.uint8)
+        if genes.shape != self._genes.shape:
+            log.error("Replacement genes do not match population layout")
+            return None
+        target = self.next_genes
+        if np.shares_memory(genes, target):
+            if genes.__array_interface__ == target.__array_interface__:
+                # Bred in place, nothing to copy
+                genes = None
+            else:
+                genes = genes.copy()
+        if genes is not None:
+            target[:] = genes
+        self._current = 1 - self._current
+        self._genes = target
+        self._fitness[:] = np.nan if fitness is None else fitness
+        self._selection = None
+        return None
+
+    def sync(self, current):
+        """
+        Follow a buffer flip made by the creating process.
+        """
+        self._current = current
+        self._genes = self._buffers[current]
+        return None
+
+    def apply_fitness(self, func, pool=None, cache=None, rows=None):
+        if pool is None or cache is not None or rows is not None:
+            return super().apply_fitness(func, pool, cache, rows)
+        self._selection = None
+        pool.evaluate_shared(func, self)
+        return None
+
+    def close(self):
+        if _ATTACHED.get(self.name) is self:
+            del _ATTACHED[self.name]
+        # Drop our views before the mapping goes away
+        self._genes = self._buffers = self._fitness = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        return None
+
+
+def _attached(spec):
+    name, _, _, current, token = spec
+    pop = _ATTACHED.get(name)
+    if pop is not None and pop._token != token:
+        # The segment was released and its name reused
+        pop.close()
+        pop = None
+    if pop is None:
+        while len(_ATTACHED) >= MAX_ATTACHED:
+            next(iter(_ATTACHED.values())).close()
+        pop = _ATTACHED[name] = SharedPopulation.attach(spec)
+    _ATTACHED.move_to_end(name)
+    pop.sync(current)
+    return pop
+
+
+def evaluate_rows(func, spec, start, stop):
+    """
+    Worker task: evaluate rows [start, stop) of a shared population,
+    writing fitness straight into the shared vector.
+    """
+    pop = _attached(spec)
+    if is_batch(func):
+        pop.fitness[start:stop] = evaluate_batch(func,
+                                                 pop.genes[start:stop])
+        return None
+    for idx in range(start, stop):
+        pop[idx].apply(func)
+    return None
+
+
+def breed_rows(spec, parents, start, crossover, mutate, seed):
+    """
+    Worker task: breed the children of a run of mating pairs into the
+    idle gene buffer of a shared population.
+    :param spec: SharedPopulation spec
+    :param parents: Parent indices for the pairs, mother then father
+    :param start: Index of the first pair
+    :param crossover: Crossover operator of the pipeline
+    :param mutate: Mutation operator of the pipeline
+    :param seed: Seed for this task's random numbers
+    """
+    np.random.seed(seed)
+    pop = _attached(spec)
+    genes = pop.genes
+    child1, child2 = crossover(genes[parents[0::2]],
+                               genes[parents[1::2]],
+                               pop.layout)
+    stop = min(2 * start + len(parents), pop.population_size)
+    children = pop.next_genes[2 * start:stop]
+    num = stop - 2 * start
+    children[0::2] = child1[:(num + 1) // 2]
+    children[1::2] = child2[:num // 2]
+    mutate(children)
+    return None
+
+
+def main():
+    from src.objects.fitness import number_ones
+    from src.objects.parallel import FitnessPool
+
+    pop = SharedPopulation(np.random.randint(0, 2, (10001, 128)),
+                           codon_length=128)
+    with FitnessPool(2) as pool:
+        for _ in range(20):
+            pop.evolve_one_step(.9, .001, number_ones, pool)
+    print(f"Segment {pop.name}: average fitness "
+          f"{pop.average_fitness():.3f}")
+    pop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 from src.objects.individual import Population, Individual
 from src.objects.chromosome import Chromosome, Codon
+from src.objects.packed import PackedPopulation
+from src.objects.rendering import FrameRenderer
 import matplotlib
 matplotlib.use('Qt5Agg')
 from matplotlib import pyplot as plt
@@ -31,15 +33,18 @@ def evolve():
         person = Individual([Chromosome([Codon(item)])])
         person.apply(number_ones)
         pop.add(person)
+    pop = PackedPopulation.from_population(pop)
+    renderer = FrameRenderer(slots=2)
 
-    im = plt.imshow(pop.to_array())
+    im = ax.imshow(renderer.frame(pop.genes), vmin=0, vmax=1,
+                   aspect="auto", interpolation="nearest")
 
     def init():
         return [im]
 
     def animate(step):
         pop.evolve_one_step(p_cross, p_mutate, number_ones)
-        im.set_array(pop.to_array())
+        im.set_data(renderer.frame(pop.genes))
         return [im]
 
     anim = animation.FuncAnimation(fig,
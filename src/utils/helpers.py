@@ -1,3 +1,5 @@
+from functools import lru_cache
+import numpy as np
 from common_imports import *
 
 log = get_logger(__name__)
@@ -6,39 +8,46 @@ log = get_logger(__name__)
 class Encoder:
     """
     Class for encoding and decoding byte strings.  String length is
-    the main parameter needed.
+    the main parameter needed.  Place values are computed once per
+    encoder and all arithmetic is exact integer arithmetic.  The
+    *_many methods convert whole arrays of numbers to gene matrices
+    (one row per number, one digit per column) and back.  Encoders are
+    immutable, so use get_encoder to share one per (length, base).
     """
 
     def __init__(self, max_len=8, base=2):
         self._len = max_len
         self._base = base
+        self._powers = tuple(base ** (max_len - idx - 1)
+                             for idx in range(max_len))
         self.max_num = self.find_max_num()
+        # Fall back to Python integers once numbers outgrow int64
+        dtype = np.int64 if self.max_num < 2 ** 63 else object
+        self._place_values = np.array(self._powers, dtype=dtype)
+
+    @property
+    def length(self):
+        return self._len
+
+    @property
+    def base(self):
+        return self._base
 
     def find_max_num(self):
-        temp = 1
-        bases = [temp]
-        for idx in range(self._len - 1):
-            temp *= self._base
-            bases.append(temp)
-        return (self._base - 1) * sum(bases)
+        return self._base ** self._len - 1
 
     def encode_num_to_bitstring(self, num):
         if num > self.max_num:
             log.error(f"Can only encode numbers as big as "
                       f"{self.max_num} -- ")
             return ""
-        ans = self._len * ["0"]
-        max_exp = self._len - 1
-        temp = self._base ** max_exp
-        for idx in range(self._len):
-            if temp > num:
-                temp /= self._base
-                max_exp -= 1
-            else:
-                ans[self._len - max_exp - 1] = str(int(num // temp))
-                num -= temp
-                max_exp -= 1
-                temp /= self._base
+        num = int(num)
+        if self._base == 2:
+            return format(num, f"0{self._len}b")
+        ans = []
+        for power in self._powers:
+            digit, num = divmod(num, power)
+            ans.append(str(digit))
         return "".join(ans)
 
     def decode_bitstring_to_num(self, string):
@@ -47,20 +56,103 @@ class Encoder:
                       f"characters long -- ")
             return None
         else:
+            if self._base <= 10:
+                return int(string, self._base)
             ans = 0
-            for idx in range(self._len):
-                if string[idx] != "0":
-                    ans += int(string[idx]) * self._base ** (
-                            self._len - idx - 1)
+            for char, power in zip(string, self._powers):
+                ans += int(char) * power
             return ans
 
+    def encode_many(self, nums):
+        """
+        Encode an array of integers into a gene matrix.
+        :param nums: 1-D array-like of integers in [0, max_num]
+        :return: uint8 array of shape (len(nums), length)
+        """
+        nums = np.asarray(nums).astype(self._place_values.dtype)
+        if len(nums) and (nums.min() < 0 or nums.max() > self.max_num):
+            log.error(f"Can only encode numbers between 0 and "
+                      f"{self.max_num} -- ")
+            return None
+        digits = (nums[:, None] // self._place_values) % self._base
+        return digits.astype(np.uint8)
+
+    def decode_many(self, genes):
+        """
+        Decode a gene matrix back into integers, one per row.
+        :param genes: Array of shape (..., length)
+        :return: Array of integers of shape genes.shape[:-1]
+        """
+        genes = np.asarray(genes)
+        if genes.shape[-1] != self._len:
+            log.error(f"Genes must be {self._len} loci long -- ")
+            return None
+        return genes.astype(self._place_values.dtype) @ self._place_values
+
+    def encode_gray_many(self, nums):
+        """
+        Binary reflected Gray code of an array of integers, so that
+        neighbouring numbers differ in a single locus.
+        """
+        if self._base != 2:
+            log.error("Gray coding is only defined for base 2")
+            return None
+        nums = np.asarray(nums).astype(self._place_values.dtype)
+        return self.encode_many(nums ^ (nums >> 1))
+
+    def decode_gray_many(self, genes):
+        if self._base != 2:
+            log.error("Gray coding is only defined for base 2")
+            return None
+        # Each binary digit is the XOR of all Gray digits before it
+        binary = np.bitwise_xor.accumulate(np.asarray(genes, np.uint8),
+                                           axis=-1)
+        return self.decode_many(binary)
+
+    def encode_real_many(self, values, low, high, gray=False):
+        """
+        Map real values in [low, high] onto the integer grid
+        0..max_num and encode them.
+        :param values: Array of reals
+        :param low: Value encoded as all zeros
+        :param high: Value encoded as max_num
+        :param gray: Use Gray coding instead of plain binary
+        :return: Gene matrix
+        """
+        values = np.clip(np.asarray(values, dtype=np.float64), low, high)
+        nums = np.rint((values - low) / (high - low) * self.max_num)
+        if gray:
+            return self.encode_gray_many(nums)
+        return self.encode_many(nums)
+
+    def decode_real_many(self, genes, low, high, gray=False):
+        nums = self.decode_gray_many(genes) if gray \
+            else self.decode_many(genes)
+        if nums is None:
+            return None
+        return low + nums.astype(np.float64) / self.max_num * (high - low)
+
+
+@lru_cache(maxsize=None)
+def get_encoder(max_len=8, base=2):
+    """
+    Shared Encoder for a given length and base.
+    """
+    return Encoder(max_len=max_len, base=base)
+
 
 def main():
-    enc = Encoder(max_len=8)
+    enc = get_encoder(max_len=8)
     print(enc.encode_num_to_bitstring(3))
     print(enc.encode_num_to_bitstring(15))
     print(enc.encode_num_to_bitstring(12))
     print(enc.decode_bitstring_to_num("00010101"))
+    genes = enc.encode_many([3, 15, 12])
+    print(genes)
+    print(enc.decode_many(genes))
+    print(enc.decode_gray_many(enc.encode_gray_many([3, 15, 12])))
+    print(enc.decode_real_many(enc.encode_real_many([-1., .5], -1, 1),
+                               -1, 1))
 
 
 if __name__ == "__main__":
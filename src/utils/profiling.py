@@ -0,0 +1,222 @@
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from common_imports import *
+
+log = get_logger(__name__)
+
+# Shared do-nothing stage for uninstrumented runs
+NO_STAGE = nullcontext()
+
+
+class StageProfiler:
+    """
+    Wall-clock timers and call counters per named stage, accumulated
+    per generation.  Stages may nest; each records only its own
+    (exclusive) time, so stage times add up to the generation's.
+
+    With a window (first, stop) of generations, those generations
+    also run under cProfile and, with trace_memory set, tracemalloc;
+    see profile_stats() and memory_snapshot.
+    """
+
+    def __init__(self, window=None, trace_memory=False):
+        self._window = window
+        self._trace_memory = trace_memory
+        self._totals = {}
+        self._calls = {}
+        self._history = []
+        self._current = None
+        self._generation = None
+        self._started = None
+        self._stack = []
+        self._cprofile = None
+        self._memory_snapshot = None
+        self._memory_peak = None
+
+    @property
+    def totals(self):
+        return dict(self._totals)
+
+    @property
+    def calls(self):
+        return dict(self._calls)
+
+    @property
+    def history(self):
+        """
+        Per generation dicts of stage seconds, plus generation and
+        total.
+        """
+        return list(self._history)
+
+    @property
+    def memory_snapshot(self):
+        return self._memory_snapshot
+
+    @property
+    def memory_peak(self):
+        return self._memory_peak
+
+    def __getstate__(self):
+        # A running cProfile cannot be pickled; its output stays with
+        # the process that captured it
+        state = self.__dict__.copy()
+        state["_cprofile"] = None
+        state["_stack"] = []
+        return state
+
+    def merge(self, other):
+        """
+        Add the timings of another profiler, e.g. one that ran in an
+        island worker.  Generations with the same number are combined,
+        so their stage times add up.
+        :param other: StageProfiler
+        :return: None
+        """
+        for name, value in other._totals.items():
+            self._totals[name] = self._totals.get(name, 0.) + value
+        for name, value in other._calls.items():
+            self._calls[name] = self._calls.get(name, 0) + value
+        rows = {row["generation"]: row for row in self._history}
+        for row in other._history:
+            mine = rows.get(row["generation"])
+            if mine is None:
+                mine = rows[row["generation"]] = dict(row)
+                self._history.append(mine)
+                continue
+            for name, value in row.items():
+                if name != "generation":
+                    mine[name] = mine.get(name, 0.) + value
+        self._history.sort(key=lambda row: row["generation"])
+        return None
+
+    def _in_window(self, generation):
+        return self._window is not None \
+            and self._window[0] <= generation < self._window[1]
+
+    def begin_generation(self, generation):
+        self._generation = generation
+        self._current = {}
+        if self._in_window(generation):
+            if self._cprofile is None:
+                self._cprofile = cProfile.Profile()
+            if self._trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._cprofile.enable()
+        self._started = time.perf_counter()
+        return None
+
+    def end_generation(self):
+        if self._started is None:
+            return None
+        total = time.perf_counter() - self._started
+        if self._in_window(self._generation):
+            self._cprofile.disable()
+            if self._generation + 1 == self._window[1] \
+                    and tracemalloc.is_tracing():
+                self._memory_snapshot = tracemalloc.take_snapshot()
+                self._memory_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        self._history.append({"generation": self._generation,
+                              "total": total, **self._current})
+        self._totals["total"] = self._totals.get("total", 0.) + total
+        self._started = None
+        self._current = None
+        return None
+
+    @contextmanager
+    def stage(self, name):
+        frame = [0.]
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += elapsed
+            own = elapsed - frame[0]
+            self._totals[name] = self._totals.get(name, 0.) + own
+            self._calls[name] = self._calls.get(name, 0) + 1
+            if self._current is not None:
+                self._current[name] = self._current.get(name, 0.) + own
+
+    def profile_stats(self, sort="cumulative"):
+        """
+        :return: pstats.Stats for the profiled window, or None
+        """
+        if self._cprofile is None:
+            return None
+        return pstats.Stats(self._cprofile).sort_stats(sort)
+
+    def summary(self):
+        """
+        :return: Dict of stage -> total seconds, calls, seconds per
+        generation and share of the run's time; "other" is time
+        spent outside any stage
+        """
+        generations = max(len(self._history), 1)
+        total = self._totals.get("total", 0.)
+        stages = {name: value for name, value in self._totals.items()
+                  if name != "total"}
+        if total:
+            stages["other"] = max(total - sum(stages.values()), 0.)
+        ans = {}
+        for name, value in sorted(stages.items(), key=lambda item:
+                                  -item[1]):
+            ans[name] = {"seconds": value,
+                         "calls": self._calls.get(name, 0),
+                         "per_generation": value / generations,
+                         "share": value / total if total else 0.}
+        return ans
+
+    def report(self, top=15):
+        """
+        Human readable summary, with the top profiled functions and
+        allocation sites when a window was captured.
+        """
+        lines = [f"{len(self._history)} generations in "
+                 f"{self._totals.get('total', 0.):.3f}s",
+                 f"{'stage':<32}{'total s':>10}{'calls':>9}"
+                 f"{'ms/gen':>10}{'share':>8}"]
+        for name, row in self.summary().items():
+            lines.append(f"{name:<32}{row['seconds']:>10.3f}"
+                         f"{row['calls']:>9}"
+                         f"{row['per_generation'] * 1000:>10.2f}"
+                         f"{row['share']:>8.1%}")
+        stats = self.profile_stats()
+        if stats is not None:
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.print_stats(top)
+            lines.append(f"cProfile, generations {self._window[0]} to "
+                         f"{self._window[1] - 1}:")
+            lines.append(stream.getvalue().strip())
+        if self._memory_snapshot is not None:
+            lines.append(f"tracemalloc peak "
+                         f"{self._memory_peak / 2 ** 20:.1f} MiB, top "
+                         f"allocation sites:")
+            for stat in self._memory_snapshot.statistics("lineno")[:top]:
+                lines.append(f"  {stat}")
+        return "\n".join(lines)
+
+
+def main():
+    profiler = StageProfiler(window=(1, 2))
+    for generation in range(3):
+        profiler.begin_generation(generation)
+        with profiler.stage("outer"):
+            time.sleep(.01)
+            with profiler.stage("inner"):
+                time.sleep(.02)
+        profiler.end_generation()
+    print(profiler.report(top=3))
+
+
+if __name__ == "__main__":
+    main()